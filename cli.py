@@ -30,10 +30,54 @@ def get_git_root():
              ("path_s3_in", None),
              ("path_s3_out", "data/raw"),
              ("prefix_name", "kickstarter")])
+@click.option(
+    "--streaming/--in-memory",
+    default=True,
+    help="Stream the .zip (on disk) into the .parquet, batch by batch")
+@click.option(
+    "--row-group-size",
+    type=int,
+    default=100000,
+    help="Rows per row group of the .parquet (streaming only)")
+@click.option(
+    "--n-workers",
+    type=int,
+    default=0,
+    help="Processes parsing the .csv files (in-memory only, 0: one per core)")
+@click.option(
+    "--raw-schema/--all-columns",
+    default=False,
+    help="Read only the columns (and dtypes) declared in utils/schema.py (default: every column)")
+@click.option(
+    "--append",
+    is_flag=True,
+    help="Also merge new and changed projects into the cumulative dataset")
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Download and save the data even if unchanged since the last run")
+@click.option(
+    "--resumable",
+    is_flag=True,
+    help="Download with HTTP Range requests, resuming interrupted downloads")
+@click.option(
+    "--n-ranges",
+    type=int,
+    default=1,
+    help="Ranges downloaded concurrently (resumable only)")
+@click.option(
+    "--sha256",
+    type=str,
+    default=None,
+    help="Expected SHA-256 of the .zip (resumable only)")
 @click.pass_context
 def gather_downloader(ctx, info_url,
                       s3_bucket_name,
-                      info_data):
+                      info_data,
+                      streaming, row_group_size,
+                      n_workers, raw_schema,
+                      append, force,
+                      resumable, n_ranges, sha256):
     return ctx.params
 
 
@@ -63,6 +107,34 @@ def gather_downloader(ctx, info_url,
              ("path_s3_in", None),
              ("path_s3_out", "models/interim"),
              ("prefix_name", "model")])
+@click.option(
+    "--fused/--step-by-step",
+    default=True,
+    help="Clean the data in a single pass (same output, less copies)")
+@click.option(
+    "--concurrency",
+    type=click.Choice(["serial", "thread", "process"]),
+    default="thread",
+    help="Pool transforming (and saving) val/test once fitted on train (in memory only)")
+@click.option(
+    "--chunk-size",
+    type=int,
+    default=0,
+    help="Process the data out-of-core, by chunks of this many rows (0: in memory)")
+@click.option(
+    "--cache/--no-cache",
+    default=False,
+    help="Reuse the fitted pipeline and output of a previous run on the same input and parameters")
+@click.option(
+    "--cache-dir",
+    type=str,
+    default=f"{get_git_root()}/data/cache",
+    help="Directory of the cache")
+@click.option(
+    "--cache-size",
+    type=int,
+    default=4096,
+    help="Max size of the cache in MB (least recently used entries are evicted)")
 @click.argument(
     "test_size",
     type=float,
@@ -76,6 +148,8 @@ def gather_downloader(ctx, info_url,
 @click.pass_context
 def gather_cleaner(ctx, s3_bucket_name,
                    info_data, info_pipe,
+                   fused, concurrency, chunk_size,
+                   cache, cache_dir, cache_size,
                    test_size, seed):
     return ctx.params
 
@@ -106,9 +180,51 @@ def gather_cleaner(ctx, s3_bucket_name,
              ("path_s3_in", None),
              ("path_s3_out", "models/processed"),
              ("prefix_name", "model")])
+@click.option(
+    "--concurrency",
+    type=click.Choice(["serial", "thread", "process"]),
+    default="thread",
+    help="Pool transforming (and saving) val/test once fitted on train (in memory only)")
+@click.option(
+    "--chunk-size",
+    type=int,
+    default=0,
+    help="Process the data out-of-core, by chunks of this many rows (0: in memory)")
+@click.option(
+    "--medians",
+    type=click.Choice(["exact", "sketch"]),
+    default="exact",
+    help="Category medians: exact, or estimated with mergeable sketches (1% relative error)")
+@click.option(
+    "--categorical",
+    type=click.Choice(["onehot", "native"]),
+    default="onehot",
+    help="Categorical features: one-hot encoded, or integer codes for the native categorical support of XGBoost/LightGBM")
+@click.option(
+    "--storage",
+    type=click.Choice(["dense", "float32", "sparse"]),
+    default="dense",
+    help="Processed data: as is (.parquet), cast to float32 (.parquet) or as a float32 CSR matrix (.npz)")
+@click.option(
+    "--cache/--no-cache",
+    default=False,
+    help="Reuse the fitted pipeline and output of a previous run on the same input and parameters")
+@click.option(
+    "--cache-dir",
+    type=str,
+    default=f"{get_git_root()}/data/cache",
+    help="Directory of the cache")
+@click.option(
+    "--cache-size",
+    type=int,
+    default=4096,
+    help="Max size of the cache in MB (least recently used entries are evicted)")
 @click.pass_context
 def gather_build_features(ctx, s3_bucket_name,
-                          info_data, info_pipe):
+                          info_data, info_pipe,
+                          concurrency, chunk_size, medians,
+                          categorical, storage,
+                          cache, cache_dir, cache_size):
     return ctx.params
 
 
@@ -199,3 +315,58 @@ def gather_register_model(ctx, s3_bucket_name,
                           n_best):
     return ctx.params
 
+
+
+@click.command()
+@click.option(
+    "--dict", "-d", "info_data",
+    type=(str, str),
+    multiple=True,
+    default=[("fnames", None),
+             ("path_local_in", f"{get_git_root()}/data/raw"),
+             ("path_local_out", f"{get_git_root()}/data/predictions"),
+             ("prefix_name", "kickstarter")])
+@click.option(
+    "--dict", "-d", "info_pipe",
+    type=(str, str),
+    multiple=True,
+    default=[("path_cleaner", f"{get_git_root()}/models/interim/model.pkl"),
+             ("path_feat_eng", f"{get_git_root()}/models/processed/model.pkl"),
+             ("path_local_in", f"{get_git_root()}/models/registry"),
+             ("path_model", None)])
+@click.argument(
+    "n_workers",
+    type=int,
+    required=False,
+    default=0)
+@click.argument(
+    "chunk_size",
+    type=int,
+    required=False,
+    default=50000)
+@click.pass_context
+def gather_batch_score(ctx, info_data, info_pipe,
+                       n_workers, chunk_size):
+    return ctx.params
+
+
+@click.command()
+@click.argument(
+    "target",
+    type=click.Choice(["cleaning", "word_count"]),
+    required=False,
+    default="cleaning")
+@click.option(
+    "--dict", "-d", "info_data",
+    type=(str, str),
+    multiple=True,
+    default=[("path_local_in", f"{get_git_root()}/data/raw"),
+             ("prefix_name", "kickstarter")])
+@click.option(
+    "--repeat",
+    type=int,
+    default=3,
+    help="Timed runs of each implementation (the best one is reported)")
+@click.pass_context
+def gather_benchmark(ctx, target, info_data, repeat):
+    return ctx.params
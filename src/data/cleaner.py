@@ -2,18 +2,24 @@ import wandb
 import logging
 import warnings
 import dotenv
+import numpy as np
+import pandas as pd
 
 from cli import gather_cleaner
 from utils.aws_s3 import save_to_s3_bucket, load_from_s3_bucket
 from utils.pipelines import ColumnDropperTransformer, \
                             DropRowsWithSameIDTransformer, \
+                            FusedCleaningTransformer, \
                             to_datetime_transformer, \
                             category_transformation, \
                             calculate_usd_goal, \
                             calculate_usd_pledged
-from utils.io import load_data, save_data, save_pipe
+from utils.io import load_data, save_data, save_pipe, \
+                     find_data, iter_data, DataWriter, map_concurrently, \
+                     data_checksums, restore_mtimes
 from utils.wandb import init_wandb_run, log_wandb_artifact, \
                         get_artifact_name
+from utils.cache import PipelineCache
 
 from sklearn.model_selection import train_test_split
 from sklearn.pipeline import Pipeline
@@ -21,6 +27,22 @@ from sklearn.compose import ColumnTransformer
 from sklearn.preprocessing import FunctionTransformer
 
 
+# (1) columns with missing values
+COLS_TO_DROP_MISSING = ['converted_pledged_amount', 'friends', 'is_backing',
+                        'is_starred', 'location', 'permissions',
+                        'usd_exchange_rate', 'usd_pledged', 'usd_type']
+# (2) irrelevant columns
+COLS_TO_DROP_IRR = ['country_displayable_name', 'creator', 'currency',
+                    'currency_symbol', 'currency_trailing_code',
+                    'current_currency', 'fx_rate', 'is_starrable',
+                    'photo', 'profile', 'slug', 'source_url',  'spotlight',
+                    'state_changed_at', 'urls', 'disable_communication']
+# (3) rows with same ID
+ID_COLUMN = 'id'
+# (4) columns to convert to datetime
+DATE_COLUMNS = ['created_at', 'deadline', 'launched_at']
+
+
 def split_train_val_test(df, test_size, seed):
 
     # The 'state' column shows the outcome of the project. We only keep
@@ -44,10 +66,18 @@ def split_train_val_test(df, test_size, seed):
     return df_split
 
 
-def create_cleaning_pipeline(columns_to_drop, id_column, date_columns):
-    """Combine all the custom transformers into a single pipeline"""
+def create_cleaning_pipeline(columns_to_drop, id_column, date_columns,
+                             fused=False):
+    """Combine all the custom transformers into a single pipeline. With
+    fused=True, a single transformer does all the steps in one pass"""
+    if fused:
+        return Pipeline([
+            ('fused_cleaner', FusedCleaningTransformer(columns_to_drop, id_column,
+                                                       date_columns))
+        ])
     pipeline = Pipeline([
-        ('column_dropper', ColumnDropperTransformer(columns_to_drop)),
+        # The raw data may already be projected (utils/schema.py)
+        ('column_dropper', ColumnDropperTransformer(columns_to_drop, errors='ignore')),
         ('row_dropper', DropRowsWithSameIDTransformer(id_column)),
         ('date_transformer', FunctionTransformer(to_datetime_transformer,
                                                  kw_args={'columns': date_columns})),
@@ -74,14 +104,56 @@ def create_cleaning_pipeline(columns_to_drop, id_column, date_columns):
     return pipeline
 
 
-def apply_cleaning_pipeline(pipe, df_split):
+def apply_cleaning_pipeline(pipe, df_split, concurrency='serial'):
+    """Fits the pipeline on train and transforms train/val/test (val and
+    test on a thread or process pool with concurrency='thread'/'process')"""
     df_split_clean = dict()
     df_split_clean['train'] = pipe.fit_transform(df_split['train'])
-    df_split_clean['val'] = pipe.transform(df_split['val'])
-    df_split_clean['test'] = pipe.transform(df_split['test'])
+    # Once fitted, val and test are independent
+    val_test = map_concurrently(pipe.transform,
+                                [df_split['val'], df_split['test']],
+                                concurrency=concurrency)
+    df_split_clean['val'], df_split_clean['test'] = val_test
     return df_split_clean, pipe
 
 
+def assign_split(ids, test_size, seed):
+    """Split (train/val/test) of each row, from a hash of its ID: rows
+    with the same ID always end up in the same split. Same proportions
+    as `split_train_val_test` (stratified in expectation only)"""
+    hash_key = f'{seed:016d}'[-16:]
+    hashes = pd.util.hash_pandas_object(ids, index=False, hash_key=hash_key)
+    u = hashes.to_numpy() / 2.**64
+    return np.where(u < test_size, 'test',
+                    np.where(u < 2 * test_size, 'val', 'train'))
+
+
+def apply_cleaning_pipeline_chunked(pipe, fname, writer, test_size, seed,
+                                    chunk_size=None, id_column=ID_COLUMN):
+    """Out-of-core `split_train_val_test` + `apply_cleaning_pipeline`:
+    the raw .parquet file is read by chunks (row groups, or `chunk_size`
+    rows), each chunk is split (see `assign_split`) and cleaned, and
+    written to its split through `writer` (utils.io.DataWriter). The
+    cleaning steps are stateless, except for the de-duplication by ID
+    which is done across chunks (keeping the first row of each ID)"""
+    seen, fitted = set(), False
+    for chunk in iter_data(fname, chunk_size=chunk_size):
+        chunk = chunk[chunk["state"].isin(["failed", "successful"])]
+        chunk = chunk[~chunk[id_column].duplicated()]
+        chunk = chunk[~chunk[id_column].isin(seen)]
+        if len(chunk) == 0:
+            continue
+        seen.update(chunk[id_column].tolist())
+        if not fitted:
+            pipe.fit(chunk)
+            fitted = True
+        chunk_clean = pipe.transform(chunk)
+        split = assign_split(chunk_clean[id_column], test_size, seed)
+        for key in ['train', 'val', 'test']:
+            writer.write(chunk_clean[split == key], key=key)
+    return pipe
+
+
 def main(params):
     """ Downloads the raw data from the S3 bucket and applies a 1st
         preprocessing pipeline to clean the data. The cleaned data
@@ -99,39 +171,8 @@ def main(params):
     load_from_s3_bucket(params["s3_bucket_name"],
                         info_data=info_data,
                         info_pipe=None)
-
-    # ------------------------- #
-    # Load raw data into Pandas #
-    # ------------------------- #
-    logger.info(f'Loading raw data to Pandas...')
-    kicks, year, month = load_data(info_data, is_split=False)
-
-    # ------------- #
-    # Split dataset #
-    # ------------- #
-    logger.info(f'Splitting raw data into train/val/test...')
-    kicks_split = split_train_val_test(kicks['full'],
-                                       params['test_size'],
-                                       params['seed'])
-    # ------------------------------- #
-    # Clean raw data using a pipeline #
-    # ------------------------------- #
-    logger.info(f'Cleaning raw data...')
-
-    # (1) columns with missing values
-    cols_to_drop_missing = ['converted_pledged_amount', 'friends', 'is_backing',
-                            'is_starred', 'location', 'permissions',
-                            'usd_exchange_rate', 'usd_pledged', 'usd_type']
-    # (2) irrelevant columns
-    cols_to_drop_irr = ['country_displayable_name', 'creator', 'currency',
-                        'currency_symbol', 'currency_trailing_code',
-                        'current_currency', 'fx_rate', 'is_starrable',
-                        'photo', 'profile', 'slug', 'source_url',  'spotlight',
-                        'state_changed_at', 'urls', 'disable_communication']
-    # (3) rows with same ID
-    id_column = 'id'
-    # (4) columns to convert to datetime
-    date_columns = ['created_at', 'deadline', 'launched_at']
+    # (so that `data_checksums` trusts the checksums of their manifest)
+    restore_mtimes(info_data)
 
     # Create pipeline:
     #   - column_dropper (1) (2)
@@ -139,21 +180,81 @@ def main(params):
     #   - date_transformer (4)
     #   - category_transformer
     #   - usd_conversion
-    full_pipeline = create_cleaning_pipeline(cols_to_drop_missing + \
-                                             cols_to_drop_irr, id_column,
-                                             date_columns)
-    # Apply pipeline to train/val/test data
-    kicks_split_clean, full_pipeline = apply_cleaning_pipeline(full_pipeline,
-                                                               kicks_split)
+    # (or all of them at once, with --fused)
+    full_pipeline = create_cleaning_pipeline(COLS_TO_DROP_MISSING + \
+                                             COLS_TO_DROP_IRR, ID_COLUMN,
+                                             DATE_COLUMNS,
+                                             fused=params["fused"])
 
-    # ---------------------------------------------- #
-    # Save clean train/val/test and pipeline locally #
-    # ---------------------------------------------- #
-    logger.info(f'Saving clean data and pipeline locally...')
-    info_data = save_data(kicks_split_clean,
-                          info_data,
-                          year, month,
-                          is_split=True)
+    # ------------------------------------------------- #
+    # Fitted pipeline and clean data of a previous run #
+    # ------------------------------------------------- #
+    cached = None
+    if params["cache"]:
+        cache = PipelineCache('cleaner', params["cache_dir"], params["cache_size"] * 2**20)
+        # (checksums of the manifest, if the raw data has one)
+        checksums = data_checksums(info_data, is_split=False)
+        key = cache.key(checksums, {'cols_to_drop': COLS_TO_DROP_MISSING + COLS_TO_DROP_IRR,
+                                    'id_column': ID_COLUMN,
+                                    'date_columns': DATE_COLUMNS,
+                                    'fused': params["fused"],
+                                    'chunk_size': params["chunk_size"],
+                                    'test_size': params["test_size"],
+                                    'seed': params["seed"]})
+        cached = cache.restore(key, info_data["path_local_out"])
+
+    if cached is not None:
+        full_pipeline, info_data["fnames"] = cached
+    elif params["chunk_size"]:
+        # ------------------------------------------------------ #
+        # Split, clean and save the raw data by chunks (locally) #
+        # ------------------------------------------------------ #
+        logger.info(f'Splitting and cleaning raw data by chunks of {params["chunk_size"]} rows...')
+        fnames, year, month = find_data(info_data, is_split=False)
+        writer = DataWriter(info_data, year, month, is_split=True)
+        full_pipeline = apply_cleaning_pipeline_chunked(full_pipeline,
+                                                        fnames['full'], writer,
+                                                        params['test_size'],
+                                                        params['seed'],
+                                                        params['chunk_size'])
+        info_data = writer.close()
+        logger.info(f'Clean rows per split: {writer.n_rows}')
+    else:
+        # ------------------------- #
+        # Load raw data into Pandas #
+        # ------------------------- #
+        logger.info(f'Loading raw data to Pandas...')
+        kicks, year, month = load_data(info_data, is_split=False)
+
+        # ------------- #
+        # Split dataset #
+        # ------------- #
+        logger.info(f'Splitting raw data into train/val/test...')
+        kicks_split = split_train_val_test(kicks['full'],
+                                           params['test_size'],
+                                           params['seed'])
+        # ------------------------------- #
+        # Clean raw data using a pipeline #
+        # ------------------------------- #
+        logger.info(f'Cleaning raw data...')
+        # Apply pipeline to train/val/test data
+        kicks_split_clean, full_pipeline = apply_cleaning_pipeline(full_pipeline,
+                                                                   kicks_split,
+                                                                   params["concurrency"])
+        logger.info(f'Saving clean data locally...')
+        info_data = save_data(kicks_split_clean,
+                              info_data,
+                              year, month,
+                              is_split=True,
+                              concurrency=params["concurrency"])
+
+    if params["cache"] and cached is None:
+        cache.store(key, full_pipeline, info_data["path_local_out"], info_data["fnames"])
+
+    # ----------------------- #
+    # Save pipeline locally #
+    # ----------------------- #
+    logger.info(f'Saving cleaning pipeline locally...')
     info_pipe = save_pipe(full_pipeline, info_pipe)
 
     # ------------------------------------------------------ #
@@ -1,17 +1,24 @@
 import os
-import io
 import re
+import json
+import time
+import hashlib
 import zipfile
 import logging
+import tempfile
 import requests
 
 import pandas as pd
 import wandb
 from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor
 
 from cli import gather_downloader
 from utils.aws_s3 import save_to_s3_bucket
-from utils.io import save_data
+from utils.io import save_data, save_csv_zip, append_snapshot
+from utils.download import download_resumable, remove_download
+from utils.schema import raw_arrow_schema, raw_read_csv_kwargs, \
+                         validate_raw, concat_raw
 from utils.wandb import init_wandb_run, log_wandb_artifact, \
                         get_artifact_name
 
@@ -33,11 +40,82 @@ def get_data_url(base_url, extension, data_format):
     return zip_file_url, year, month
 
 
-def download_raw_data(zip_file_url):
-    r = requests.get(zip_file_url)
-    zf = zipfile.ZipFile(io.BytesIO(r.content))
-    dfs = [pd.read_csv(zf.open(f)) for f in zf.namelist()]
-    df = pd.concat(dfs, ignore_index=True)
+def download_to_file(url, f, snapshot=None, chunk_size=1 << 20):
+    """Downloads `url` into the (binary) file object `f`, chunk by chunk.
+
+    If `snapshot` (the state of a previous download) is of the same URL,
+    the download is conditional (ETag/Last-Modified) and None is
+    returned when the server says it hasn't changed. Otherwise returns
+    the state of this download: URL, ETag, Last-Modified and SHA-256"""
+    headers = {}
+    if snapshot is not None and snapshot.get('url') == url:
+        if snapshot.get('etag'):
+            headers['If-None-Match'] = snapshot['etag']
+        if snapshot.get('last_modified'):
+            headers['If-Modified-Since'] = snapshot['last_modified']
+    sha256 = hashlib.sha256()
+    with requests.get(url, stream=True, headers=headers) as r:
+        if r.status_code == 304:
+            return None
+        r.raise_for_status()
+        for chunk in r.iter_content(chunk_size=chunk_size):
+            f.write(chunk)
+            sha256.update(chunk)
+    f.flush()
+    return {'url': url,
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+            'sha256': sha256.hexdigest()}
+
+
+def load_snapshot_state(path):
+    """State of the last snapshot downloaded (empty if none)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_snapshot_state(path, snapshot):
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(snapshot, f, indent=2)
+    os.replace(f'{path}.tmp', path)
+
+
+def read_csv_member(zip_path, member, raw_schema=False):
+    """Parses a .csv of the .zip (in a worker process), projected and
+    typed as declared in utils.schema if `raw_schema`. Returns the
+    DataFrame and the time it took"""
+    start = time.perf_counter()
+    with zipfile.ZipFile(zip_path) as zf:
+        if raw_schema:
+            df = validate_raw(pd.read_csv(zf.open(member), **raw_read_csv_kwargs()))
+        else:
+            df = pd.read_csv(zf.open(member))
+    return df, time.perf_counter() - start
+
+
+def read_raw_data(zip_path, n_workers=None, raw_schema=False):
+    """Parses the .csv files of the .zip in `n_workers` processes
+    (default: one per core). DataFrames are concatenated in the order
+    of the members, whatever the order they finish in"""
+    logger = logging.getLogger(__name__)
+    n_workers = n_workers or os.cpu_count()
+    with zipfile.ZipFile(zip_path) as zf:
+        members = [m for m in zf.namelist() if m.endswith('.csv')]
+    if not members:
+        raise ValueError(f'No .csv files in {zip_path}')
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=min(n_workers, len(members))) as executor:
+        results = list(executor.map(read_csv_member,
+                                    [zip_path] * len(members), members,
+                                    [raw_schema] * len(members)))
+    for member, (df, seconds) in zip(members, results):
+        logger.info(f'Parsed {member} ({len(df)} rows) in {seconds:.2f} s')
+    logger.info(f'Parsed {len(members)} files in {time.perf_counter() - start:.2f} s '
+                f'({n_workers} workers)')
+    dfs = [df for df, _ in results]
+    df = concat_raw(dfs) if raw_schema else pd.concat(dfs, ignore_index=True)
     return df
 
 
@@ -57,21 +135,59 @@ def main(params):
                                              info_url['extension'],
                                              info_url['data_format'])
 
-    # -------------------- #
-    # Downloading the data #
-    # -------------------- #
-    logger.info(f'Downloading raw data ({month}/{year}) from {info_url["base_url"]}/...')
-    df = download_raw_data(zip_file_url)
-
-    # ---------------------------------------------------------- #
-    # Save the data (multiple .csv) as unique .parquet (locally) #
-    # ---------------------------------------------------------- #
-    logger.info(f'Saving raw data locally...')
     info_data = dict(params['info_data'])
-
-    info_data = save_data(df, info_data,
-                          year, month,
-                          is_split=False)
+    path_state = f'{info_data["path_local_out"]}/{info_data["prefix_name"]}_snapshot.json'
+    state = {} if params['force'] else load_snapshot_state(path_state)
+    # Resumable downloads are kept (next to the data) until processed
+    path_zip = f'{info_data["path_local_out"]}/{os.path.basename(zip_file_url)}'
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # ------------------------------------------------- #
+        # Download the .zip to disk (unless it's unchanged) #
+        # ------------------------------------------------- #
+        logger.info(f'Downloading raw data ({month}/{year}) from {info_url["base_url"]}/...')
+        if params['resumable']:
+            snapshot = download_resumable(zip_file_url, path_zip,
+                                          snapshot=state,
+                                          n_ranges=params['n_ranges'],
+                                          expected_sha256=params['sha256'])
+        else:
+            path_zip = f'{tmp_dir}/{os.path.basename(zip_file_url)}'
+            with open(path_zip, 'wb') as f:
+                snapshot = download_to_file(zip_file_url, f, snapshot=state)
+        if snapshot is None or snapshot['sha256'] == state.get('sha256'):
+            logger.info(f'Raw data ({month}/{year}) unchanged since the last download, nothing to do')
+            remove_download(path_zip)
+            return
+
+        if params['streaming']:
+            # ------------------------------------- #
+            # Stream the .csv files into a .parquet #
+            # ------------------------------------- #
+            logger.info(f'Saving raw data locally (streaming)...')
+            info_data = save_csv_zip(path_zip, info_data,
+                                     year, month,
+                                     row_group_size=params['row_group_size'],
+                                     schema=raw_arrow_schema() if params['raw_schema'] else None)
+        else:
+            # ---------------------------------------------------------- #
+            # Save the data (multiple .csv) as unique .parquet (locally) #
+            # ---------------------------------------------------------- #
+            logger.info(f'Saving raw data locally...')
+            df = read_raw_data(path_zip, params['n_workers'],
+                               params['raw_schema'])
+            info_data = save_data(df, info_data,
+                                  year, month,
+                                  is_split=False)
+
+    # ------------------------------------------------------ #
+    # Merge new/changed projects into the cumulative dataset #
+    # ------------------------------------------------------ #
+    if params['append']:
+        logger.info(f'Appending new and changed projects to the cumulative dataset...')
+        # (kept locally: it's not uploaded to the S3 bucket)
+        part, n_rows = append_snapshot(f'{info_data["path_local_out"]}/{info_data["fnames"][0]}',
+                                       info_data, year, month)
+        logger.info(f'{n_rows} new or changed projects appended ({part})')
 
     # --------------------------------------- #
     # Save the data im S3 Bucket (LocalStack) #
@@ -94,6 +210,11 @@ def main(params):
                        path_to_log=info_data["path_s3_out"])
     wandb.finish()
 
+    # Only once everything went well: the next run skips this snapshot
+    save_snapshot_state(path_state, {**snapshot, 'year': year, 'month': month,
+                                     'fnames': info_data['fnames']})
+    remove_download(path_zip)
+
 
 def wrapper_poetry():
     """ So that we can call this script using Poetry"""
@@ -0,0 +1,118 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+def _concat(parts):
+    # Records come either as DataFrames (JSON) or float32 matrices
+    if all(isinstance(X, pd.DataFrame) for X in parts):
+        return pd.concat(parts)
+    return np.concatenate([np.asarray(X) for X in parts])
+
+
+class QueueFullError(Exception):
+    """Raised when the micro-batching queue can't take more requests"""
+
+
+class MicroBatcher:
+    """
+    Collects the records of concurrent prediction requests for up to
+    `window_ms` milliseconds (or until `max_batch_size` records are
+    gathered), scores them with a single call of `score_fn` and fans the
+    results back out to each request.
+
+    The queue is bounded (`max_queue_size` requests): when it's full,
+    `submit` raises QueueFullError instead of buffering without limit.
+    """
+
+    def __init__(self, score_fn, window_ms=3.0, max_batch_size=64,
+                 max_queue_size=1024):
+        # score_fn(model, X) -> (labels, probabilities), one per row of X
+        self.score_fn = score_fn
+        self.window = window_ms / 1000.
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Threads don't survive a fork (e.g. gunicorn workers), so the
+        # scheduler is started lazily in the process that uses it
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_queue_size)
+                thread = threading.Thread(target=self._run, daemon=True)
+                thread.start()
+                self._pid = os.getpid()
+
+    def submit(self, model, X):
+        """Queues the records X to be scored with `model`. Returns a
+        Future that resolves to the (labels, probabilities) of X"""
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put_nowait((model, X, future))
+        except queue.Full:
+            raise QueueFullError(f'More than {self.max_queue_size} requests waiting')
+        return future
+
+    def _collect(self):
+        """Blocks until one request arrives, then keeps collecting until
+        the window closes or the batch is full"""
+        batch = [self._queue.get()]
+        n_records = len(batch[0][1])
+        deadline = time.monotonic() + self.window
+        while n_records < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(item)
+            n_records += len(item[1])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Requests queued around a hot-reload may use different models
+            by_model = {}
+            for item in batch:
+                by_model.setdefault(id(item[0]), []).append(item)
+            for items in by_model.values():
+                self._score(items)
+
+    def _score(self, items):
+        model = items[0][0]
+        try:
+            X = _concat([X for _, X, _ in items]) if len(items) > 1 else items[0][1]
+            labels, probabilities = self.score_fn(model, X)
+        except Exception as e:
+            if len(items) == 1:
+                items[0][2].set_exception(e)
+                return
+            # Don't let a single malformed request fail the whole batch
+            logger.exception('Batched scoring failed, scoring requests one by one')
+            for item in items:
+                self._score([item])
+            return
+
+        start = 0
+        for _, X, future in items:
+            end = start + len(X)
+            future.set_result((labels[start:end], probabilities[start:end]))
+            start = end
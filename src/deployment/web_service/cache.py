@@ -0,0 +1,82 @@
+import time
+import hashlib
+import threading
+import collections
+import numpy as np
+import pandas as pd
+
+
+class PredictionCache:
+    """
+    In-process LRU cache of predictions, keyed by a stable hash of the
+    feature vector. Bounded to `max_size` entries, which optionally
+    expire after `ttl` seconds. The whole cache is invalidated when the
+    model serving the requests changes.
+    """
+
+    def __init__(self, max_size=10000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._model_key = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def keys(X):
+        """Hash of each row of X (DataFrame or matrix). Values are hashed
+        as float32, the precision of the compact formats, so that a record
+        gets the same key whether it was sent as JSON (float64) or not"""
+        if isinstance(X, pd.DataFrame):
+            X = X.to_numpy(dtype=np.float32)
+        # +0. turns -0. into 0. and NaNs are made all the same
+        X = np.ascontiguousarray(X, dtype=np.float32) + np.float32(0.)
+        X[np.isnan(X)] = np.nan
+        return [hashlib.blake2b(row.tobytes(), digest_size=16).digest() for row in X]
+
+    def _check_model(self, model_key):
+        # Predictions of a previous model are no longer valid
+        if model_key != self._model_key:
+            self._entries.clear()
+            self._model_key = model_key
+
+    def get_many(self, model_key, keys):
+        """Cached (labels, probabilities) of the given keys, plus the
+        positions of the keys that were not found (or expired)"""
+        labels = np.empty(len(keys), dtype=object)
+        probabilities = np.empty(len(keys))
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            self._check_model(model_key)
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is None or (entry[2] is not None and entry[2] < now):
+                    missing.append(i)
+                    continue
+                self._entries.move_to_end(key)
+                labels[i], probabilities[i] = entry[0], entry[1]
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        return labels, probabilities, missing
+
+    def put_many(self, model_key, keys, labels, probabilities):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._check_model(model_key)
+            for key, label, proba in zip(keys, labels, probabilities):
+                self._entries[key] = (label, proba, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.,
+                    "size": len(self._entries),
+                    "max_size": self.max_size,
+                    "ttl": self.ttl}
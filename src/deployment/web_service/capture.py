@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import queue
+import base64
+import random
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class RequestRecorder:
+    """
+    Appends a sample of the incoming requests to a JSONL file, one
+    request per line:
+
+        {"ts": ..., "endpoint": "/predict", "content_type": "...", "body": ...}
+
+    JSON bodies are stored as they were sent, other bodies (MessagePack,
+    Arrow) base64 encoded (plus "encoding": "base64"). Requests are
+    queued as they come in, before being served, so those rejected
+    (e.g. 400) are captured too and replayed as such. Lines are written
+    in batches by a background thread, so serving never waits for the
+    disk. When the queue is full (the disk can't keep up) captured
+    requests are dropped.
+    """
+
+    def __init__(self, path, sample_rate=1., max_queue_size=10000,
+                 flush_size=256, flush_interval_s=1.):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_queue_size = max_queue_size
+        self.flush_size = flush_size
+        self.flush_interval_s = flush_interval_s
+        self.captured = 0
+        self.dropped = 0
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # The writer is started lazily (and again in each forked worker,
+        # since threads don't survive the fork)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_queue_size)
+                threading.Thread(target=self._run, daemon=True,
+                                 name='request-recorder').start()
+                self._pid = os.getpid()
+
+    def capture(self, endpoint, content_type, body):
+        """Queues the request with probability `sample_rate`"""
+        if random.random() >= self.sample_rate:
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((time.time(), endpoint, content_type, body))
+            captured = True
+        except queue.Full:
+            captured = False
+        # Requests are captured from several threads (gthread workers)
+        with self._lock:
+            if captured:
+                self.captured += 1
+            else:
+                self.dropped += 1
+
+    @staticmethod
+    def _to_line(ts, endpoint, content_type, body):
+        entry = {"ts": ts, "endpoint": endpoint, "content_type": content_type}
+        try:
+            if content_type is None or not content_type.endswith('json'):
+                raise ValueError
+            entry["body"] = json.loads(body)
+        except ValueError:
+            entry["body"] = base64.b64encode(body).decode('ascii')
+            entry["encoding"] = "base64"
+        return json.dumps(entry) + '\n'
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval_s
+            while len(items) < self.flush_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                lines = ''.join(self._to_line(*item) for item in items)
+                # A single append per batch, so that the lines written by
+                # several workers don't interleave
+                with open(self.path, 'ab', buffering=0) as f:
+                    f.write(lines.encode('utf-8'))
+            except Exception:
+                logger.exception(f'Could not write {len(items)} captured requests to {self.path}')
+
+
+def load_captured(path):
+    """Reads the captured requests back: (endpoint, content_type, body bytes)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry.get("encoding") == "base64":
+                body = base64.b64decode(entry["body"])
+            else:
+                body = json.dumps(entry["body"]).encode('utf-8')
+            yield entry["endpoint"], entry["content_type"], body
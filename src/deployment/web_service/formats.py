@@ -0,0 +1,149 @@
+import json
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:  # Optional: only needed for MessagePack requests
+    msgpack = None
+try:
+    import pyarrow as pa
+except ImportError:  # Optional: only needed for Arrow IPC requests
+    pa = None
+
+
+# Compact request formats. All of them carry feature vectors (already
+# feature engineered) and are decoded straight into a contiguous float32
+# matrix, in the order of the features the model was trained with.
+COLUMNAR_JSON = 'application/vnd.kickstarter.columnar+json'
+MSGPACK = ('application/msgpack', 'application/x-msgpack')
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+
+
+class PayloadError(ValueError):
+    """Raised when a request body can't be decoded into features"""
+
+
+def is_compact(content_type):
+    return content_type in (COLUMNAR_JSON, ARROW_STREAM) + MSGPACK
+
+
+def feature_order(names, model_features):
+    """Validates the features of a batch (once) and returns the column
+    indices that put them in the model's order (None if already sorted)"""
+    # Names may come from numpy arrays (np.str_), messages show plain strings
+    names = [str(name) for name in names]
+    if model_features is None:
+        return None
+    model_features = [str(name) for name in model_features]
+    if names == model_features:
+        return None
+    position = {name: i for i, name in enumerate(names)}
+    missing = [name for name in model_features if name not in position]
+    if missing:
+        raise PayloadError(f'Missing features: {missing}')
+    if len(names) != len(model_features):
+        extra = sorted(set(names) - set(model_features))
+        raise PayloadError(f'Unexpected features: {extra}')
+    return np.array([position[name] for name in model_features])
+
+
+def _from_layout(payload, model_features):
+    """{"ids": [...], "features": [...], "values": [[...], ...]}
+
+    `features` (the column order of `values`) can be omitted when the
+    values already follow the model's order. With MessagePack, `values`
+    can also be the raw bytes of a little-endian float32 row-major
+    matrix (plus its "shape")."""
+    try:
+        values = payload['values']
+    except (KeyError, TypeError):
+        raise PayloadError('Payload must be an object with "values"')
+    names = payload.get('features') or model_features
+    if names is None:
+        raise PayloadError('"features" are required')
+
+    try:
+        if isinstance(values, (bytes, bytearray, memoryview)):
+            shape = payload.get('shape') or (-1, len(names))
+            X = np.frombuffer(values, dtype='<f4').reshape(shape)
+        else:
+            X = np.asarray(values, dtype=np.float32)
+    except (ValueError, TypeError) as e:
+        # Ragged or non-numeric values, or a buffer that doesn't fit "shape"
+        raise PayloadError(f'Invalid "values": {e}')
+    if X.ndim != 2 or X.shape[1] != len(names):
+        raise PayloadError(f'Expected {len(names)} values per record')
+
+    order = feature_order(names, model_features)
+    if order is not None:
+        X = X[:, order]
+    ids = payload.get('ids')
+    if ids is None:
+        ids = list(range(len(X)))
+    elif not isinstance(ids, list) or len(ids) != len(X):
+        raise PayloadError('"ids" and "values" have different lengths')
+    return list(ids), np.ascontiguousarray(X, dtype=np.float32)
+
+
+def decode_columnar_json(body, model_features):
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        raise PayloadError(f'Invalid JSON: {e}')
+    return _from_layout(payload, model_features)
+
+
+def decode_msgpack(body, model_features):
+    if msgpack is None:
+        raise PayloadError('MessagePack is not supported (msgpack is not installed)')
+    try:
+        payload = msgpack.unpackb(body, raw=False)
+    except Exception as e:
+        raise PayloadError(f'Invalid MessagePack: {e}')
+    return _from_layout(payload, model_features)
+
+
+def decode_arrow_stream(body, model_features, id_column='id'):
+    """Arrow IPC stream, one (numeric) column per feature plus an
+    optional `id` column"""
+    if pa is None:
+        raise PayloadError('Arrow is not supported (pyarrow is not installed)')
+    try:
+        table = pa.ipc.open_stream(body).read_all()
+    except Exception as e:
+        raise PayloadError(f'Invalid Arrow IPC stream: {e}')
+
+    names = [name for name in table.column_names if name != id_column]
+    # Only validates the schema, column data are never reordered
+    feature_order(names, model_features)
+    names = model_features if model_features is not None else names
+
+    X = np.empty((table.num_rows, len(names)), dtype=np.float32)
+    for j, name in enumerate(names):
+        column = table.column(name)
+        if not (pa.types.is_integer(column.type) or pa.types.is_floating(column.type)
+                or pa.types.is_boolean(column.type) or pa.types.is_null(column.type)):
+            raise PayloadError(f'Feature {name} must be numeric, not {column.type}')
+        try:
+            column = column.cast(pa.float32())
+            if column.null_count:
+                column = column.fill_null(np.nan)
+            X[:, j] = column.to_numpy()
+        except (pa.ArrowException, ValueError, TypeError) as e:
+            raise PayloadError(f'Invalid values of feature {name}: {e}')
+    if id_column in table.column_names:
+        ids = table.column(id_column).to_pylist()
+    else:
+        ids = list(range(table.num_rows))
+    return ids, X
+
+
+def decode(content_type, body, model_features):
+    """Returns the record ids and their feature matrix (float32)"""
+    if content_type == COLUMNAR_JSON:
+        return decode_columnar_json(body, model_features)
+    if content_type in MSGPACK:
+        return decode_msgpack(body, model_features)
+    if content_type == ARROW_STREAM:
+        return decode_arrow_stream(body, model_features)
+    raise PayloadError(f'Unsupported content type: {content_type}')
@@ -0,0 +1,42 @@
+# Production serving configuration: `gunicorn -c gunicorn.conf.py predict:app`
+#
+# The app (and so the model) is loaded once in the master process, before
+# forking the workers. Workers then share the model's memory pages
+# copy-on-write instead of each one holding its own copy.
+
+import gc
+import os
+import multiprocessing
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:9696")
+# Processes serving requests (default: one per core)
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+# Threads per worker. With more than one, requests are served by threaded
+# workers (needed for micro-batching, see MICRO_BATCHING)
+threads = int(os.getenv("GUNICORN_THREADS", "1"))
+worker_class = "gthread" if threads > 1 else "sync"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+
+# Load the app in the master. predict.py then loads the model synchronously
+# (a background thread wouldn't survive the fork)
+preload_app = True
+os.environ.setdefault("PRELOAD_MODEL", "1")
+
+
+def when_ready(server):
+    # Objects created so far (mostly the model) are moved to a permanent
+    # generation, so that the GC of the workers doesn't write to (and
+    # copy) the pages they live in
+    gc.freeze()
+    if workers > 1:
+        server.log.warning(f"{workers} workers: /metrics and /cache/stats only report the worker "
+                           "answering each request (set GUNICORN_WORKERS=1 for complete metrics)")
+
+
+def post_fork(server, worker):
+    # The master loads the model without running it (OpenMP isn't
+    # fork-safe), so its first prediction happens in each worker
+    import predict
+    predict.MODEL_HOLDER.warm_up()
+    server.log.info(f"Worker {worker.pid} spawned "
+                    f"(threads={threads}, model threads={os.getenv('MODEL_NTHREAD', 'default')})")
@@ -0,0 +1,184 @@
+import time
+import bisect
+import threading
+
+
+# Minimal Prometheus-style metrics (text exposition format 0.0.4). An
+# update is a lock + a couple of additions, i.e. well below a few
+# microseconds per request. Metrics are kept per process (worker).
+
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def labels(self, *labelvalues):
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labelvalues, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self, labelvalues, child):
+        raise NotImplementedError
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.kind}']
+        for labelvalues, child in list(self._children.items()):
+            lines += self._samples(labelvalues, child)
+        return lines
+
+
+class _Value:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1.):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1.):
+        self._children[()].inc(amount)
+
+    def _samples(self, labelvalues, child):
+        return [f'{self.name}{_format_labels(self.labelnames, labelvalues)} {child.value}']
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1.):
+        self._children[()].dec(amount)
+
+    def set(self, value):
+        self._children[()].set(value)
+
+
+class _HistogramValue:
+    __slots__ = ('upper_bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, upper_bounds):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.upper_bounds)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def time(self):
+        return _Timer(self._children[()])
+
+    def _samples(self, labelvalues, child):
+        with child._lock:
+            counts, total = list(child.counts), child.sum
+        samples, cumulative = [], 0
+        for bound, count in zip(self.upper_bounds + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            labels = _format_labels(self.labelnames, labelvalues, ('le', le))
+            samples.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, labelvalues)
+        samples.append(f'{self.name}_sum{labels} {total}')
+        samples.append(f'{self.name}_count{labels} {cumulative}')
+        return samples
+
+
+class _Timer:
+    """Context manager observing the elapsed time (in seconds)"""
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """`collector()` returns extra lines computed at scrape time"""
+        self.collectors.append(collector)
+
+    def expose(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.expose()
+        for collector in self.collectors:
+            lines += collector()
+        return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -1,10 +1,28 @@
 import os
+import re
+import hmac
 import wandb
 import json
+import time
 import pickle
+import logging
+import functools
+import threading
+import collections
+import numpy as np
 import pandas as pd
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+from batching import MicroBatcher, QueueFullError
+from formats import PayloadError, is_compact, decode, feature_order
+from cache import PredictionCache
+from capture import RequestRecorder
+from metrics import Registry, Counter, Gauge, Histogram, CONTENT_TYPE
+from utils.inference import transform_raw_records, compile_pipelines, model_feature_names, \
+                            zeros_as_missing
+from utils.pipelines import parse_category
 
 
 AWS_ENDPOINT_URL = os.getenv("AWS_ENDPOINT_URL")
@@ -17,86 +35,589 @@ WANDB_PROJECT = os.getenv("WANDB_PROJECT")
 WANDB_INTERIM_MODELS = os.getenv("WANDB_INTERIM_MODELS")
 WANDB_PROCESSED_MODELS = os.getenv("WANDB_PROCESSED_MODELS")
 WANDB_REGISTERED_MODELS = os.getenv("WANDB_REGISTERED_MODELS")
+WANDB_REGISTERED_VERSION = os.getenv("WANDB_REGISTERED_VERSION", "v0")
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "./model_cache")
+# /admin/reload is disabled (404) unless a token is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Load the model before serving (set by gunicorn.conf.py, so that the
+# model is loaded in the master and shared by the forked workers)
+PRELOAD_MODEL = os.getenv("PRELOAD_MODEL", "0") == "1"
+# Threads used by XGBoost/LightGBM in each worker (nthread/num_threads)
+MODEL_NTHREAD = int(os.getenv("MODEL_NTHREAD", "0")) or None
+# Accept raw Kickstarter records (cleaned and feature engineered here)
+SERVE_RAW_RECORDS = os.getenv("SERVE_RAW_RECORDS", "0") == "1"
+SAMPLE_RAW_RECORDS = os.getenv("SAMPLE_RAW_RECORDS", "sample_kickstarter_raw_project.json")
+# Micro-batching of concurrent /predict requests (opt-in)
+MICRO_BATCHING = os.getenv("MICRO_BATCHING", "0") == "1"
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "3"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "64"))
+BATCH_QUEUE_SIZE = int(os.getenv("BATCH_QUEUE_SIZE", "1024"))
+BATCH_TIMEOUT_S = float(os.getenv("BATCH_TIMEOUT_S", "10"))
+# LRU cache of predictions (size 0 disables it, TTL 0 means no expiration)
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_TTL_S = float(os.getenv("PREDICTION_CACHE_TTL_S", "0")) or None
+# Capture of the incoming requests, to replay them later (opt-in)
+CAPTURE_PATH = os.getenv("CAPTURE_PATH")
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "1"))
+
+
+# Names and versions of the artifacts that /admin/reload accepts. They are
+# always looked up in the configured entity/project (and cache dir), so
+# they can't contain a path. Versions are either vN or one of the aliases
+# set by W&B and by the training/registration scripts
+ARTIFACT_NAME = re.compile(r'[A-Za-z0-9][A-Za-z0-9_.-]{0,127}')
+ARTIFACT_ALIASES = ['latest', 'best', 'staging']
+ARTIFACT_VERSION = re.compile(r'v\d+|' + '|'.join(ARTIFACT_ALIASES))
+
+# Fields of a raw record that every feature depends on (any other field
+# missing in a record is considered null)
+REQUIRED_RAW_FIELDS = ['category', 'goal', 'static_usd_rate']
+# Fields of a raw record that must be numbers if present (dates are unix
+# timestamps, in seconds)
+NUMERIC_RAW_FIELDS = ['goal', 'static_usd_rate', 'created_at', 'launched_at', 'deadline']
 
 
 app = Flask(WANDB_PROJECT)
+logger = logging.getLogger(__name__)
+
+# ------- #
+# Metrics #
+# ------- #
+METRICS = Registry()
+REQUESTS = METRICS.register(Counter(
+    'kickstarter_requests_total', 'Requests served', ['endpoint', 'status']))
+REQUEST_LATENCY = METRICS.register(Histogram(
+    'kickstarter_request_latency_seconds', 'End-to-end latency of the requests', ['endpoint']))
+IN_FLIGHT = METRICS.register(Gauge(
+    'kickstarter_requests_in_flight', 'Requests being served'))
+STAGE_LATENCY = METRICS.register(Histogram(
+    'kickstarter_stage_latency_seconds',
+    'Latency of each stage of a request (parse, prepare, cache, inference)', ['stage']))
+RECORDS = METRICS.register(Counter(
+    'kickstarter_records_total', 'Records scored', ['endpoint']))
+BATCH_SIZE = METRICS.register(Histogram(
+    'kickstarter_batch_size', 'Records per request', ['endpoint'],
+    buckets=(1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000)))
+MICRO_BATCH_SIZE = METRICS.register(Histogram(
+    'kickstarter_micro_batch_size', 'Records per micro-batch scored together',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)))
+MODEL_LOADS = METRICS.register(Counter(
+    'kickstarter_model_loads_total', 'Models (and pipelines) loaded'))
+MODEL_LOAD_SECONDS = METRICS.register(Gauge(
+    'kickstarter_model_load_seconds', 'Duration of the last model load'))
 
 
-# def load_preprocessing_pipeline(api, option):
-#     """
-#     Loads a preprocessing pipeline from W&B
-#     """
-#
-#     model_artifact = api.artifact(f'{WANDB_ENTITY}/{WANDB_PROJECT}/{option}:v0', type='model')
-#     os.makedirs(f'{option}', exist_ok=True)
-#     path = f"./{option}"
-#     model_artifact.download(root=path)
-#     with open(f'{path}/model.pkl', 'rb') as file:
-#         pipe = pickle.load(file)
-#     return pipe
+def wandb_api():
+    wandb.login(key=WANDB_API_KEY)
+    return wandb.Api()
+
+
+def load_preprocessing_pipeline(name, cache_dir, force_download=False):
+    """
+    Loads a preprocessing pipeline from the local cache directory. It's
+    only downloaded from W&B if it is not cached yet (or if forced)
+    """
+    path = f'{cache_dir}/{name}'
+    if force_download or not os.path.exists(f'{path}/model.pkl'):
+        model_artifact = wandb_api().artifact(f'{WANDB_ENTITY}/{WANDB_PROJECT}/{name}:v0', type='model')
+        os.makedirs(path, exist_ok=True)
+        model_artifact.download(root=path)
+    with open(f'{path}/model.pkl', 'rb') as file:
+        pipe = pickle.load(file)
+    return pipe
 
 
-def load_model_from_registry(api):
+def load_model_from_registry(name, version, cache_dir, force_download=False):
     """
-    Loads the ML model from the W&B registry
+    Loads the ML model from the local cache directory. The model is
+    only downloaded from the W&B registry if it is not cached yet
+    (or if a fresh download is forced)
     """
-    model_artifact = api.artifact(f'{WANDB_ENTITY}/model-registry/{WANDB_REGISTERED_MODELS}:v0', type='model')
-    model_artifact.download(root="./")
-    with open(f'{WANDB_REGISTERED_MODELS}.pkl', 'rb') as file:
+    path = f'{cache_dir}/{name}/{version}'
+    if force_download or not os.path.exists(f'{path}/{name}.pkl'):
+        model_artifact = wandb_api().artifact(f'{WANDB_ENTITY}/model-registry/{name}:{version}', type='model')
+        os.makedirs(path, exist_ok=True)
+        model_artifact.download(root=path)
+    with open(f'{path}/{name}.pkl', 'rb') as file:
         registered_model = pickle.load(file)
     return registered_model
 
 
-#def prepare_data(records_json, cleaner_pipe, engineer_pipe):
-def prepare_data(records_json):
-    # Parse the JSON data into a Python dictionary
-    data_dict = json.loads(records_json)
-    # Convert the dictionary to a pandas DataFrame
-    df = pd.DataFrame.from_dict(data_dict, orient='index')
-    # Cleaning records
-    # df = cleaner_pipe.transform(df)
-    # # Feature engineering the records
-    # df = engineer_pipe.transform(df)
-    # Extract the target column and divide X,y
-    # target = 'state'
-    # y = df[target]
-    # X = df.drop(target, axis=1)
-    return df
+def set_model_threads(model, n_threads):
+    """Per-worker thread budget of the model. `n_jobs` is mapped to
+    `nthread` by XGBoost and to `num_threads` by LightGBM"""
+    if n_threads is not None and 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=n_threads)
+
+
+def warm_up(model):
+    """Runs a dummy prediction so that the first request doesn't pay
+    for lazy initializations inside XGBoost/LightGBM"""
+    n_features = getattr(model, 'n_features_in_', None)
+    if n_features is None:
+        return
+    columns = model_feature_names(model)
+    model.predict(pd.DataFrame(np.zeros((1, n_features)), columns=columns))
+
+
+class RawRecordsPreprocessor:
+    """Cleans and feature engineers raw records with the fitted pipelines.
+    Single records are the common case, so they go through a precompiled
+    transform (plain arrays) instead of the nested ColumnTransformers"""
+
+    def __init__(self, cleaner_pipe, engineer_pipe, check_records=None):
+        self.cleaner_pipe = cleaner_pipe
+        self.engineer_pipe = engineer_pipe
+        try:
+            self.compiled = compile_pipelines(cleaner_pipe, engineer_pipe)
+        except ValueError as e:
+            logger.warning(f'Using the sklearn pipelines to prepare records: {e}')
+            self.compiled = None
+        if self.compiled is not None and check_records:
+            self._check(check_records)
+
+    def _check(self, records):
+        """Falls back to the sklearn pipelines if the precompiled
+        transform doesn't reproduce their output"""
+        expected = self.transform(records, compiled=False)
+        if not np.array_equal(self.transform(records).values,
+                              expected.values, equal_nan=True):
+            logger.warning('Precompiled transform differs from the pipelines, disabling it')
+            self.compiled = None
+
+    @staticmethod
+    def validate(data_dict):
+        """Raises a PayloadError naming the required fields missing (or
+        null) in the records, or those of the wrong type"""
+        for idx, record in data_dict.items():
+            if not isinstance(record, dict):
+                raise PayloadError(f'Record {idx} must be an object')
+            missing = [field for field in REQUIRED_RAW_FIELDS if record.get(field) is None]
+            if missing:
+                raise PayloadError(f'Record {idx} is missing required fields: {missing}')
+            not_numeric = [field for field in NUMERIC_RAW_FIELDS
+                           if record.get(field) is not None
+                           and (isinstance(record[field], bool)
+                                or not isinstance(record[field], (int, float)))]
+            if not_numeric:
+                raise PayloadError(f'Record {idx} has non-numeric fields: {not_numeric}')
+            try:
+                parse_category(record['category'])
+            except (ValueError, TypeError, KeyError, AttributeError, SyntaxError):
+                raise PayloadError(f'Record {idx} has an invalid category: {record["category"]!r}')
+
+    def transform(self, data_dict, compiled=True):
+        self.validate(data_dict)
+        try:
+            if compiled and self.compiled is not None:
+                X = self.compiled.transform_records(data_dict.values())
+                return pd.DataFrame(X, index=list(data_dict.keys()),
+                                    columns=self.compiled.feature_names)
+            df = pd.DataFrame.from_dict(data_dict, orient='index')
+            return transform_raw_records(df, self.cleaner_pipe, self.engineer_pipe)
+        except (ValueError, TypeError, OverflowError) as e:
+            # Values that pass the checks but can't be transformed (e.g. dates out of range)
+            raise PayloadError(f'Invalid raw records: {e}')
+
+
+def load_sample_records(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+# `load_id` tells loads apart (e.g. reloads of the same version), unlike
+# id(model), which CPython reuses once the old model is collected
+LoadedModel = collections.namedtuple('LoadedModel', ['model', 'name', 'version', 'preprocessor', 'load_id'])
+
+
+class ModelHolder:
+    """Keeps the registered model in memory for the whole life of the
+    worker. A reload builds the new model aside and swaps a single
+    reference, so requests see either the old or the new model"""
+
+    def __init__(self, name, version, cache_dir,
+                 interim_name=None, processed_name=None):
+        self.name = name
+        self.version = version
+        self.cache_dir = cache_dir
+        # Cleaning and feat. eng. pipelines (only for raw records)
+        self.interim_name = interim_name
+        self.processed_name = processed_name
+        self.current = None
+        self.error = None
+        # Number of loads so far (never reused)
+        self.loads = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_ready(self):
+        return self.current is not None
+
+    def load(self, name=None, version=None, force_download=False,
+             interim_name=None, processed_name=None, warm=True):
+        # Only one load at a time, requests keep using self.current meanwhile
+        with self._lock:
+            start = time.perf_counter()
+            name = name or self.name
+            version = version or self.version
+            model = load_model_from_registry(name, version, self.cache_dir,
+                                             force_download=force_download)
+            set_model_threads(model, MODEL_NTHREAD)
+            if warm:
+                warm_up(model)
+            preprocessor = None
+            if SERVE_RAW_RECORDS:
+                interim_name = interim_name or self.interim_name
+                processed_name = processed_name or self.processed_name
+                cleaner_pipe = load_preprocessing_pipeline(interim_name, self.cache_dir,
+                                                           force_download=force_download)
+                engineer_pipe = load_preprocessing_pipeline(processed_name, self.cache_dir,
+                                                            force_download=force_download)
+                preprocessor = RawRecordsPreprocessor(cleaner_pipe, engineer_pipe,
+                                                      load_sample_records(SAMPLE_RAW_RECORDS))
+                self.interim_name, self.processed_name = interim_name, processed_name
+            self.loads += 1
+            self.current = LoadedModel(model, name, version, preprocessor, self.loads)
+            self.name, self.version, self.error = name, version, None
+            MODEL_LOADS.inc()
+            MODEL_LOAD_SECONDS.set(time.perf_counter() - start)
+            logger.info(f'Serving model {name}:{version}')
+            return self.current
+
+    def warm_up(self):
+        """Warms up the model being served (see `load(warm=False)`)"""
+        if self.current is not None:
+            warm_up(self.current.model)
+
+    def load_in_background(self):
+        def target():
+            try:
+                self.load()
+            except Exception as e:
+                self.error = repr(e)
+                logger.exception('Could not load the registered model')
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        return thread
+
+
+def prepare_data(records_json, preprocessor=None):
+    # Parse the JSON data into a Python dictionary (if not parsed yet)
+    if isinstance(records_json, str):
+        try:
+            data_dict = json.loads(records_json)
+        except json.JSONDecodeError as e:
+            raise PayloadError(f'Invalid JSON: {e}')
+    else:
+        data_dict = records_json
+    if not isinstance(data_dict, dict):
+        raise PayloadError('Payload must be an object of records ({id: record, ...})')
+    if not data_dict:
+        raise PayloadError('No records to score')
+    # Clean and feature engineer raw records
+    if preprocessor is not None:
+        return preprocessor.transform(data_dict)
+    # Otherwise, records are already feature vectors
+    return pd.DataFrame.from_dict(data_dict, orient='index')
+
+
+def model_features(current):
+    """Names of the features the model was trained with (in order)"""
+    names = model_feature_names(current.model)
+    if names is None and current.preprocessor is not None \
+            and current.preprocessor.compiled is not None:
+        names = current.preprocessor.compiled.feature_names
+    return None if names is None else list(names)
+
+
+def align_features(model, preprocessed_data):
+    """JSON objects carry no column order, use the one seen during
+    training. Missing, unexpected or non-numeric features raise a
+    PayloadError"""
+    if not isinstance(preprocessed_data, pd.DataFrame):
+        return preprocessed_data
+    feature_names = model_feature_names(model)
+    if feature_names is not None:
+        feature_order(preprocessed_data.columns, feature_names)
+        preprocessed_data = preprocessed_data[feature_names]
+    non_numeric = [name for name, dtype in preprocessed_data.dtypes.items()
+                   if not pd.api.types.is_numeric_dtype(dtype)]
+    if non_numeric:
+        try:
+            # e.g. a column where every record sent null
+            preprocessed_data = preprocessed_data.astype({name: np.float64 for name in non_numeric})
+        except (ValueError, TypeError):
+            raise PayloadError(f'Non-numeric features: {non_numeric}')
+    return preprocessed_data
+
+
+def parse_request(current):
+    """Record ids and features of the request. Compact formats
+    (columnar JSON, MessagePack, Arrow) are decoded straight into a
+    float32 matrix; plain JSON goes through `prepare_data`"""
+    if is_compact(request.mimetype):
+        with STAGE_LATENCY.labels('parse').time():
+            ids, X = decode(request.mimetype, request.get_data(), model_features(current))
+        if not ids:
+            raise PayloadError('No records to score')
+        return ids, X
+    with STAGE_LATENCY.labels('parse').time():
+        records = request.get_json()
+    with STAGE_LATENCY.labels('prepare').time():
+        X = prepare_data(records, current.preprocessor)
+        return X.index.tolist(), align_features(current.model, X)
+
 
+def predict_batch(model, preprocessed_data):
+    """Scores all the records in a single `predict_proba` pass and
+    returns their labels and probabilities of success (input order)"""
 
-def predict(model, preprocessed_data):
+    with STAGE_LATENCY.labels('inference').time():
+        proba = model.predict_proba(zeros_as_missing(model, preprocessed_data))
+    classes = model.classes_[np.argmax(proba, axis=1)]
+    labels = np.where(classes == 1, "Successful", "Failed")
+    return labels, proba[:, 1]
 
-    prediction = model.predict(preprocessed_data)
 
-    if prediction[0] == 1:
-        return "Successful"
-    else:  # == 0
-        return "Failed"
+# Loaded once per worker (at startup) and served from memory afterwards
+MODEL_HOLDER = ModelHolder(WANDB_REGISTERED_MODELS,
+                           WANDB_REGISTERED_VERSION,
+                           MODEL_CACHE_DIR,
+                           interim_name=WANDB_INTERIM_MODELS,
+                           processed_name=WANDB_PROCESSED_MODELS)
+if PRELOAD_MODEL:
+    # Loaded in the gunicorn master, which then forks the workers. The
+    # OpenMP runtime of XGBoost/LightGBM isn't fork-safe, so the model
+    # must not predict before the fork: each worker warms it up instead
+    # (post_fork in gunicorn.conf.py)
+    MODEL_HOLDER.load(warm=False)
+else:
+    MODEL_HOLDER.load_in_background()
+
+def predict_micro_batch(model, preprocessed_data):
+    MICRO_BATCH_SIZE.observe(len(preprocessed_data))
+    return predict_batch(model, preprocessed_data)
+
+
+BATCHER = MicroBatcher(predict_micro_batch,
+                       window_ms=BATCH_WINDOW_MS,
+                       max_batch_size=BATCH_MAX_SIZE,
+                       max_queue_size=BATCH_QUEUE_SIZE) if MICRO_BATCHING else None
+
+CACHE = PredictionCache(max_size=PREDICTION_CACHE_SIZE,
+                        ttl=PREDICTION_CACHE_TTL_S) if PREDICTION_CACHE_SIZE > 0 else None
+
+
+def score(current, X, micro_batching=False):
+    """Labels and probabilities of X, scored together with other
+    concurrent requests if micro-batching is enabled"""
+    if BATCHER is None or not micro_batching:
+        return predict_batch(current.model, X)
+    future = BATCHER.submit(current.model, X)
+    return future.result(timeout=BATCH_TIMEOUT_S)
+
+
+def cached_score(current, X, micro_batching=False):
+    """Like `score`, but only the records that are not cached (for the
+    current model) are actually scored"""
+    if CACHE is None:
+        return score(current, X, micro_batching)
+    model_key = current.load_id
+    with STAGE_LATENCY.labels('cache').time():
+        keys = CACHE.keys(X)
+        labels, probabilities, missing = CACHE.get_many(model_key, keys)
+    if missing:
+        X_missing = X.iloc[missing] if isinstance(X, pd.DataFrame) else X[missing]
+        new_labels, new_probabilities = score(current, X_missing, micro_batching)
+        with STAGE_LATENCY.labels('cache').time():
+            CACHE.put_many(model_key, [keys[i] for i in missing],
+                           new_labels, new_probabilities)
+        labels[missing] = new_labels
+        probabilities[missing] = new_probabilities
+    return labels, probabilities
+
+
+def cache_metrics():
+    """Cache statistics, read at scrape time"""
+    if CACHE is None:
+        return []
+    stats = CACHE.stats()
+    lines = []
+    for name, kind, value, documentation in [
+            ('kickstarter_cache_hits_total', 'counter', stats['hits'], 'Prediction cache hits'),
+            ('kickstarter_cache_misses_total', 'counter', stats['misses'], 'Prediction cache misses'),
+            ('kickstarter_cache_entries', 'gauge', stats['size'], 'Predictions in the cache')]:
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}', f'{name} {value}']
+    return lines
+
+
+METRICS.register_collector(cache_metrics)
+
+RECORDER = RequestRecorder(CAPTURE_PATH, sample_rate=CAPTURE_SAMPLE_RATE) \
+    if CAPTURE_PATH else None
+
+
+def capture_metrics():
+    """Captured (and dropped) requests, read at scrape time"""
+    if RECORDER is None:
+        return []
+    lines = []
+    for name, value, documentation in [
+            ('kickstarter_captured_requests_total', RECORDER.captured, 'Requests captured'),
+            ('kickstarter_capture_dropped_total', RECORDER.dropped, 'Captured requests dropped (queue full)')]:
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} counter', f'{name} {value}']
+    return lines
+
+
+METRICS.register_collector(capture_metrics)
+
+
+@app.before_request
+def capture_request():
+    if RECORDER is not None and request.path in ('/predict', '/predict_batch'):
+        RECORDER.capture(request.path, request.mimetype, request.get_data())
+
+
+def instrumented(endpoint):
+    """Counts the requests of the endpoint (by status) and records their
+    latency and how many are in flight"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            IN_FLIGHT.inc()
+            start = time.perf_counter()
+            status = 500
+            try:
+                response = func(*args, **kwargs)
+                status = response[1] if isinstance(response, tuple) else 200
+                return response
+            except HTTPException as e:
+                # e.g. a body that isn't JSON (400) or of another type (415)
+                status = e.code
+                raise
+            finally:
+                IN_FLIGHT.dec()
+                REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - start)
+                REQUESTS.labels(endpoint, str(status)).inc()
+        return wrapper
+    return decorator
+
+
+@app.route("/health/live", methods=['GET'])
+def liveness_endpoint():
+    return jsonify({"status": "alive"})
+
+
+@app.route("/health/ready", methods=['GET'])
+def readiness_endpoint():
+    current = MODEL_HOLDER.current
+    if current is None:
+        status = "error" if MODEL_HOLDER.error else "loading"
+        return jsonify({"status": status, "error": MODEL_HOLDER.error}), 503
+    return jsonify({"status": "ready",
+                    "model": current.name,
+                    "version": current.version})
+
+
+@app.route("/admin/reload", methods=['POST'])
+def reload_endpoint():
+    """Hot-reloads the registered model, e.g. after a new model has been
+    promoted by `promote_model_to_registry`. Only available when
+    ADMIN_TOKEN is set (sent in the X-Admin-Token header). Optional JSON
+    body, with artifacts of the configured W&B entity/project:
+    {"name": "model_<run_id>", "version": "v1",
+     "interim": "<cleaning pipeline>", "processed": "<feat. eng. pipeline>"}"""
+
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Not found"}), 404
+    token = request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"error": "Forbidden"}), 403
+
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return jsonify({"error": "Body must be a JSON object"}), 400
+    for field, pattern in [('name', ARTIFACT_NAME), ('version', ARTIFACT_VERSION),
+                           ('interim', ARTIFACT_NAME), ('processed', ARTIFACT_NAME)]:
+        value = body.get(field)
+        if value is not None and not (isinstance(value, str) and pattern.fullmatch(value)):
+            return jsonify({"error": f'Invalid "{field}": {value!r}'}), 400
+    try:
+        current = MODEL_HOLDER.load(name=body.get('name'),
+                                    version=body.get('version'),
+                                    force_download=True,
+                                    interim_name=body.get('interim'),
+                                    processed_name=body.get('processed'))
+    except Exception as e:
+        # The previous model (if any) keeps serving requests
+        logger.exception('Could not reload the registered model')
+        return jsonify({"error": repr(e)}), 500
+    return jsonify({"model": current.name, "version": current.version})
 
 
 @app.route("/predict", methods=['POST'])
+@instrumented('predict')
 def predict_endpoint():
 
-    wandb.login(key=WANDB_API_KEY)
-    api = wandb.Api()
+    current = MODEL_HOLDER.current
+    if current is None:
+        return jsonify({"error": "Model is not loaded yet"}), 503
+
+    # Decode the records (cleaned and feature engineered if raw)
+    try:
+        _, X = parse_request(current)
+    except PayloadError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Predict the outcome of Kickstarter project (model already in memory)
+    try:
+        labels, _ = cached_score(current, X, micro_batching=True)
+    except QueueFullError:
+        return jsonify({"error": "Server busy, try again later"}), 503
+
+    RECORDS.labels('predict').inc(len(labels))
+    BATCH_SIZE.labels('predict').observe(len(labels))
+    return jsonify({"Kickstarter Project": labels[0]})
+
+
+@app.route("/predict_batch", methods=['POST'])
+@instrumented('predict_batch')
+def predict_batch_endpoint():
+    """Same payload as /predict ({id: record, ...}, or any of the compact
+    formats) but with as many records as needed, all scored together"""
+
+    current = MODEL_HOLDER.current
+    if current is None:
+        return jsonify({"error": "Model is not loaded yet"}), 503
+
+    try:
+        ids, X = parse_request(current)
+    except PayloadError as e:
+        return jsonify({"error": str(e)}), 400
+    labels, probabilities = cached_score(current, X)
+    RECORDS.labels('predict_batch').inc(len(labels))
+    BATCH_SIZE.labels('predict_batch').observe(len(labels))
 
-    records = request.get_json()
-    print(records)
-    # Loads the cleaning and feat. engineering pipelines from W&B
-    # cleaner_pipe = load_preprocessing_pipeline(api, WANDB_INTERIM_MODELS)
-    # engineer_pipe = load_preprocessing_pipeline(api, WANDB_PROCESSED_MODELS)
+    predictions = [{"id": idx, "label": label, "probability": float(proba)}
+                   for idx, label, proba in zip(ids,
+                                                labels.tolist(),
+                                                probabilities.tolist())]
+    return jsonify({"predictions": predictions})
 
-    # Clean and feature engineer the records
-    # X, y = prepare_data(records, cleaner_pipe, engineer_pipe)
-    X = prepare_data(records)
 
-    # Loads model from Model Registry
-    registered_model = load_model_from_registry(api)
+@app.route("/cache/stats", methods=['GET'])
+def cache_stats_endpoint():
+    if CACHE is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **CACHE.stats()})
 
-    # Predict the outcome of Kickstarter project
-    outcome = predict(registered_model, X)
 
-    return jsonify({"Kickstarter Project": outcome})
+@app.route("/metrics", methods=['GET'])
+def metrics_endpoint():
+    """Metrics in Prometheus text format (of the worker serving the scrape)"""
+    return Response(METRICS.expose(), content_type=CONTENT_TYPE)
 
 
 if __name__ == '__main__':
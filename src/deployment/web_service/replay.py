@@ -0,0 +1,148 @@
+"""
+Replays the requests captured by the service (CAPTURE_PATH) against a
+running instance and reports latency percentiles, throughput and errors.
+
+    python replay.py requests.jsonl --rps 200 --duration 30
+    python replay.py requests.jsonl --concurrency 16 --requests 5000
+
+With --rps requests are sent at a fixed rate (open loop) and latency is
+measured from the time each request was due, so that a slow server isn't
+hidden by a client waiting for it. With --concurrency (closed loop) each
+worker sends its next request as soon as the previous one finishes.
+"""
+import time
+import argparse
+import itertools
+import threading
+import collections
+import numpy as np
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+
+from capture import load_captured
+
+
+_local = threading.local()
+
+
+def _session():
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def send(url, endpoint, content_type, body, timeout):
+    """Returns (endpoint, status, end time); status is None if the request failed"""
+    try:
+        response = _session().post(f'{url}{endpoint}', data=body, timeout=timeout,
+                                   headers={'Content-Type': content_type})
+        status = response.status_code
+    except requests.RequestException:
+        status = None
+    return endpoint, status, time.perf_counter()
+
+
+def run_open_loop(url, captured, rps, n_requests, timeout, max_workers):
+    """Sends `n_requests` at `rps` requests per second"""
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        start = time.perf_counter()
+        futures = []
+        for i, item in enumerate(itertools.islice(captured, n_requests)):
+            due = start + i / rps
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append((due, executor.submit(send, url, *item, timeout)))
+        for due, future in futures:
+            endpoint, status, end = future.result()
+            results.append((endpoint, status, end - due))
+    return results, time.perf_counter() - start
+
+
+def run_closed_loop(url, captured, concurrency, n_requests, timeout):
+    """Sends `n_requests` from `concurrency` workers, back to back"""
+    lock = threading.Lock()
+    captured = itertools.islice(captured, n_requests)
+    results = []
+
+    def worker():
+        while True:
+            with lock:
+                item = next(captured, None)
+            if item is None:
+                return
+            begin = time.perf_counter()
+            endpoint, status, end = send(url, *item, timeout)
+            with lock:
+                results.append((endpoint, status, end - begin))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def report(results, elapsed):
+    by_endpoint = collections.defaultdict(list)
+    for endpoint, status, latency in results:
+        by_endpoint[endpoint].append((status, latency))
+    by_endpoint['all'] = [(status, latency) for _, status, latency in results]
+
+    print(f'{len(results)} requests in {elapsed:.2f} s '
+          f'({len(results) / elapsed:.1f} requests/s)')
+    print(f'{"endpoint":<16}{"requests":>10}{"errors":>10}{"error %":>10}'
+          f'{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for endpoint, values in by_endpoint.items():
+        statuses = [status for status, _ in values]
+        errors = sum(status is None or status >= 400 for status in statuses)
+        p50, p95, p99 = np.percentile([latency for _, latency in values], [50, 95, 99]) * 1000
+        print(f'{endpoint:<16}{len(values):>10}{errors:>10}{100 * errors / len(values):>10.2f}'
+              f'{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}')
+    statuses = collections.Counter(status for _, status, _ in results)
+    print('Status codes: ' + ', '.join(f'{"failed" if status is None else status}: {count}'
+                                       for status, count in sorted(statuses.items(), key=str)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay captured requests against the service')
+    parser.add_argument('path', nargs='?', default='requests.jsonl',
+                        help='JSONL file written by the service (CAPTURE_PATH)')
+    parser.add_argument('--url', default='http://localhost:9696')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--rps', type=float, help='Target requests per second (open loop)')
+    mode.add_argument('--concurrency', type=int, default=8,
+                      help='Concurrent clients (closed loop, the default)')
+    parser.add_argument('--requests', type=int,
+                        help='Requests to send (default: each captured request once)')
+    parser.add_argument('--duration', type=float,
+                        help='Seconds to run for, with --rps (overrides --requests)')
+    parser.add_argument('--max-workers', type=int, default=256,
+                        help='Max. requests in flight with --rps')
+    parser.add_argument('--timeout', type=float, default=10)
+    args = parser.parse_args()
+
+    captured = list(load_captured(args.path))
+    if not captured:
+        parser.error(f'No requests in {args.path}')
+    n_requests = args.requests or len(captured)
+    if args.rps and args.duration:
+        n_requests = int(args.rps * args.duration)
+    # The captured requests are sent in order, cycling over them if needed
+    requests_iter = itertools.cycle(captured)
+
+    if args.rps:
+        results, elapsed = run_open_loop(args.url, requests_iter, args.rps, n_requests,
+                                         args.timeout, args.max_workers)
+    else:
+        results, elapsed = run_closed_loop(args.url, requests_iter, args.concurrency,
+                                           n_requests, args.timeout)
+    report(results, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,8 +4,22 @@ import requests
 with open("sample_kickstarter_project.json", "r", encoding="utf-8") as infile:
     sample = json.load(infile)
 
-URL = "http://localhost:9696/predict"
-# Convert the Python dictionary to a JSON string
-sample_json = json.dumps(sample)
-response = requests.post(URL, json=sample_json, timeout=10)
+URL = "http://localhost:9696"
+# The dictionary is encoded as JSON (only once) by `requests`
+response = requests.post(f"{URL}/predict", json=sample, timeout=10)
+print(response.json())
+
+# Several records (here, copies of the sample) scored in a single call
+batch = {f"{key}_{i}": record for i in range(3) for key, record in sample.items()}
+response = requests.post(f"{URL}/predict_batch", json=batch, timeout=10)
+print(response.json())
+
+# Same records in the compact columnar layout: feature names sent only once
+features = list(next(iter(batch.values())).keys())
+columnar = {"ids": list(batch.keys()),
+            "features": features,
+            "values": [[record[name] for name in features] for record in batch.values()]}
+response = requests.post(f"{URL}/predict_batch", data=json.dumps(columnar),
+                         headers={"Content-Type": "application/vnd.kickstarter.columnar+json"},
+                         timeout=10)
 print(response.json())
\ No newline at end of file
@@ -2,10 +2,14 @@ import wandb
 import logging
 import warnings
 import dotenv
+import numpy as np
+import pandas as pd
 
 from cli import gather_build_features
 from utils.aws_s3 import save_to_s3_bucket, load_from_s3_bucket
-from utils.io import load_data, save_data, save_pipe
+from utils.io import load_data, save_data, save_pipe, \
+                     find_data, iter_data, DataWriter, map_concurrently, \
+                     data_checksums, restore_mtimes
 from utils.pipelines import calculate_name_length, \
                             calculate_description_length, \
                             calculate_creation_to_launch_hours, \
@@ -15,7 +19,9 @@ from utils.pipelines import calculate_name_length, \
                             turn_to_log
 from utils.wandb import init_wandb_run, log_wandb_artifact, \
                          get_artifact_name
+from utils.cache import PipelineCache
 
+from sklearn.base import clone
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
 from sklearn.preprocessing import FunctionTransformer, \
@@ -23,8 +29,29 @@ from sklearn.preprocessing import FunctionTransformer, \
                                   OrdinalEncoder
 
 
+# Categorical features, one-hot encoded (categorical='onehot') or kept as
+# integer codes for the native categorical support of XGBoost/LightGBM
+# (categorical='native')
+CATEGORICAL_FEATURES = ['staff_pick', 'sub_category', 'country', 'main_category']
+
+
+def create_categorical_encoder(categorical='onehot', dtype=np.float64):
+    """One-hot encoder (one column per category, of `dtype`) or ordinal
+    encoder (one column of codes per feature, NaN for unknown or missing
+    categories)"""
+    if categorical == 'onehot':
+        return OneHotEncoder(handle_unknown="ignore", sparse_output=False, dtype=dtype)
+    if categorical == 'native':
+        return OrdinalEncoder(handle_unknown='use_encoded_value', unknown_value=np.nan,
+                              encoded_missing_value=np.nan, dtype=np.float32)
+    raise ValueError(f"categorical must be 'onehot' or 'native', got {categorical!r}")
+
+
 def create_feat_eng_pipeline(cols_to_drop, cols_to_log,
-                             cols_to_scale_encode):
+                             cols_to_scale_encode,
+                             median_method='exact',
+                             categorical='onehot',
+                             dtype=np.float64):
     """Combine all the custom transformers into a single pipeline"""
 
     preprocessor_sentence_length = ColumnTransformer(
@@ -61,8 +88,8 @@ def create_feat_eng_pipeline(cols_to_drop, cols_to_log,
 
     preprocessor_scale_and_encode = ColumnTransformer(
             transformers=[
-                ("categorical_encoder", OneHotEncoder(handle_unknown="ignore", sparse_output=False),
-                                                      cols_to_scale_encode['cat']),
+                ("categorical_encoder", create_categorical_encoder(categorical, dtype),
+                                        cols_to_scale_encode['cat']),
                 ("numerical_scaler", StandardScaler(), cols_to_scale_encode['num']),
                 ("target_encoder", OrdinalEncoder(categories=cols_to_scale_encode['target_mapping']),
                                                   cols_to_scale_encode['target'])
@@ -74,7 +101,7 @@ def create_feat_eng_pipeline(cols_to_drop, cols_to_log,
     pipeline = Pipeline([
         ('sentence_length', preprocessor_sentence_length),
         ('time_duration', preprocessor_time_duration),
-        ('median_diff', MedianDiffCalculatorTransformer()),
+        ('median_diff', MedianDiffCalculatorTransformer(method=median_method)),
         ('passthrough', 'passthrough'),
         ('column_dropper', ColumnDropperTransformer(cols_to_drop)),
         ('log_converter', preprocessor_log_converter),
@@ -84,14 +111,87 @@ def create_feat_eng_pipeline(cols_to_drop, cols_to_log,
     return pipeline
 
 
-def apply_feat_eng_pipeline(pipe, df_split_clean):
+def apply_feat_eng_pipeline(pipe, df_split_clean, concurrency='serial'):
+    """Fits the pipeline on train and transforms train/val/test (val and
+    test on a thread or process pool with concurrency='thread'/'process')"""
     df_split_processed = dict()
     df_split_processed['train'] = pipe.fit_transform(df_split_clean['train'])
-    df_split_processed['val'] = pipe.transform(df_split_clean['val'])
-    df_split_processed['test'] = pipe.transform(df_split_clean['test'])
+    # Once fitted, val and test are independent
+    val_test = map_concurrently(pipe.transform,
+                                [df_split_clean['val'], df_split_clean['test']],
+                                concurrency=concurrency)
+    df_split_processed['val'], df_split_processed['test'] = val_test
     return df_split_processed, pipe
 
 
+def fit_feat_eng_pipeline_chunked(pipe, fname_train, chunk_size=None):
+    """Out-of-core `pipe.fit` on the train split (.parquet file), read by
+    chunks (row groups, or `chunk_size` rows):
+      - median_diff: medians from the only columns they need, either
+        exact or sketched chunk by chunk (method='sketch')
+      - stateless steps: fitted on the first chunk
+      - scale_and_encode: scalers with `partial_fit` over the chunks, and
+        encoders fitted on the categories seen in all the chunks"""
+    steps = [(name, step) for name, step in pipe.steps
+             if step is not None and step != 'passthrough']
+    *head, (_, last) = steps
+
+    median_diff = pipe.named_steps['median_diff']
+    columns = ['main_category', 'sub_category', 'usd_goal']
+    if median_diff.method == 'sketch':
+        for chunk in iter_data(fname_train, columns=columns, chunk_size=chunk_size):
+            median_diff.partial_fit(chunk)
+    else:
+        median_diff.fit(pd.read_parquet(fname_train, columns=columns))
+
+    streamed = {name: clone(transformer) for name, transformer, _ in last.transformers
+                if hasattr(transformer, 'partial_fit')}
+    encoded = [column for _, transformer, columns in last.transformers
+               if hasattr(transformer, 'categories') for column in columns]
+    categories, first = {}, None
+    for chunk in iter_data(fname_train, chunk_size=chunk_size):
+        if len(chunk) == 0:
+            continue
+        X = chunk
+        for name, step in head:
+            if first is None and name != 'median_diff':
+                step.fit(X)
+            X = step.transform(X)
+        if first is None:
+            first = X.iloc[:1]
+        for name, transformer, columns in last.transformers:
+            if name in streamed:
+                streamed[name].partial_fit(X[columns])
+        for column in encoded:
+            categories[column] = pd.concat([categories.get(column),
+                                            X[column].drop_duplicates()]).drop_duplicates()
+
+    # The last step is fitted on a few rows holding every category, and
+    # its scalers then take the statistics of the whole train split
+    n_rows = max([len(values) for values in categories.values()], default=0)
+    extra = first.iloc[[0] * n_rows].reset_index(drop=True)
+    for column, values in categories.items():
+        values = values.tolist()
+        extra[column] = values + values[:1] * (n_rows - len(values))
+    last.fit(pd.concat([first, extra], ignore_index=True))
+    for name, transformer in last.named_transformers_.items():
+        if name in streamed:
+            vars(transformer).update(vars(streamed[name]))
+    return pipe
+
+
+def apply_feat_eng_pipeline_chunked(pipe, fnames_split_clean, writer, chunk_size=None):
+    """Out-of-core `apply_feat_eng_pipeline`: fits the pipeline on the
+    train split (see `fit_feat_eng_pipeline_chunked`) and transforms the
+    train/val/test .parquet files chunk by chunk, writing the output
+    through `writer` (utils.io.DataWriter)"""
+    pipe = fit_feat_eng_pipeline_chunked(pipe, fnames_split_clean['train'], chunk_size)
+    for key in ['train', 'val', 'test']:
+        for chunk in iter_data(fnames_split_clean[key], chunk_size=chunk_size):
+            writer.write(pipe.transform(chunk), key=key)
+    return pipe
+
+
 def main(params):
     """ Downloads the cleaned data from the S3 bucket and applies a 2nd
         preprocessing pipeline to augment the data (feature engineering).
@@ -110,12 +210,8 @@ def main(params):
     load_from_s3_bucket(params["s3_bucket_name"],
                         info_data=info_data,
                         info_pipe=None)
-
-    # ----------------------------- #
-    # Load cleaned data into Pandas #
-    # ----------------------------- #
-    logger.info(f'Loading cleaned data into Pandas...')
-    kicks_split_clean, year, month = load_data(info_data, is_split=True)
+    # (so that `data_checksums` trusts the checksums of their manifest)
+    restore_mtimes(info_data)
 
     # ------------------------------------ #
     # Feat. Eng. the data using a pipeline #
@@ -133,7 +229,7 @@ def main(params):
                           'country', 'main_category']
                    }
     # (3) Columns to scale and encode
-    cols_to_scale_encode = {'cat': ['staff_pick', 'sub_category', 'country', 'main_category'],
+    cols_to_scale_encode = {'cat': CATEGORICAL_FEATURES,
                             'num': ['creation_to_launch_hours', 'campaign_hours', 'name_length',
                                     'description_length', 'usd_goal', 'diff_main_category_goal',
                                     'diff_sub_category_goal'],
@@ -147,24 +243,78 @@ def main(params):
     #   - Difference between the median and the current category's goal
     #   - Drop columns (1)
     #   - Convert numerical to normal distribution (2)
-    #   - Scale numerical feat. and Encode categorical and target feat. (3)
+    #   - Scale numerical feat. and Encode categorical (one-hot or integer
+    #     codes, see CATEGORICAL_FEATURES) and target feat. (3)
 
+    if params["storage"] == 'sparse' and params["categorical"] == 'native':
+        raise ValueError('Sparse storage is meant for one-hot features (--categorical onehot)')
+    # With float32/sparse storage the pipeline emits the one-hot block as float32
     full_pipeline = create_feat_eng_pipeline(cols_to_drop,
                                              cols_to_log,
-                                             cols_to_scale_encode)
-
-    # Apply pipeline to train/val/test data
-    kicks_split_processed, full_pipeline = apply_feat_eng_pipeline(full_pipeline,
-                                                                   kicks_split_clean)
-
-    # -------------------------------------------------- #
-    # Save processed train/val/test and pipeline locally #
-    # -------------------------------------------------- #
-    logger.info(f'Saving processed (augmented) data and pipeline locally...')
-    info_data = save_data(kicks_split_processed,
-                          info_data,
-                          year, month,
-                          is_split=True)
+                                             cols_to_scale_encode,
+                                             median_method=params["medians"],
+                                             categorical=params["categorical"],
+                                             dtype=np.float64 if params["storage"] == 'dense'
+                                                   else np.float32)
+
+    # ------------------------------------------------------ #
+    # Fitted pipeline and processed data of a previous run #
+    # ------------------------------------------------------ #
+    cached = None
+    if params["cache"]:
+        cache = PipelineCache('build_features', params["cache_dir"], params["cache_size"] * 2**20)
+        # (checksums of the manifest, if the clean data has one)
+        checksums = data_checksums(info_data, is_split=True)
+        key = cache.key(checksums, {'cols_to_drop': cols_to_drop,
+                                    'cols_to_log': cols_to_log,
+                                    'cols_to_scale_encode': cols_to_scale_encode,
+                                    'medians': params["medians"],
+                                    'categorical': params["categorical"],
+                                    'storage': params["storage"],
+                                    'chunk_size': params["chunk_size"]})
+        cached = cache.restore(key, info_data["path_local_out"])
+
+    if cached is not None:
+        full_pipeline, info_data["fnames"] = cached
+    elif params["chunk_size"]:
+        # ------------------------------------------------- #
+        # Apply pipeline and save data by chunks (locally) #
+        # ------------------------------------------------- #
+        logger.info(f'Processing the data by chunks of {params["chunk_size"]} rows...')
+        fnames, year, month = find_data(info_data, is_split=True)
+        writer = DataWriter(info_data, year, month, is_split=True,
+                            storage=params["storage"],
+                            dense_columns=cols_to_scale_encode['num'])
+        full_pipeline = apply_feat_eng_pipeline_chunked(full_pipeline, fnames, writer,
+                                                        params["chunk_size"])
+        info_data = writer.close()
+    else:
+        # ----------------------------- #
+        # Load cleaned data into Pandas #
+        # ----------------------------- #
+        logger.info(f'Loading cleaned data into Pandas...')
+        kicks_split_clean, year, month = load_data(info_data, is_split=True)
+
+        # Apply pipeline to train/val/test data
+        kicks_split_processed, full_pipeline = apply_feat_eng_pipeline(full_pipeline,
+                                                                       kicks_split_clean,
+                                                                       params["concurrency"])
+        logger.info(f'Saving processed (augmented) data locally...')
+        info_data = save_data(kicks_split_processed,
+                              info_data,
+                              year, month,
+                              is_split=True,
+                              concurrency=params["concurrency"],
+                              storage=params["storage"],
+                              dense_columns=cols_to_scale_encode['num'])
+
+    if params["cache"] and cached is None:
+        cache.store(key, full_pipeline, info_data["path_local_out"], info_data["fnames"])
+
+    # ----------------------- #
+    # Save pipeline locally #
+    # ----------------------- #
+    logger.info(f'Saving feat. eng. pipeline locally...')
     info_pipe = save_pipe(full_pipeline, info_pipe)
 
     # ---------------------------------------------------------- #
@@ -0,0 +1,140 @@
+import os
+import glob
+import pickle
+import logging
+import dotenv
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from cli import gather_batch_score
+from utils.inference import transform_raw_records, model_feature_names, zeros_as_missing
+
+
+# Fitted pipelines and model, loaded once per worker process
+_worker = {}
+
+
+def load_pickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def init_worker(path_cleaner, path_feat_eng, path_model):
+    """Initializer of the worker processes"""
+    _worker['cleaner'] = load_pickle(path_cleaner)
+    _worker['feat_eng'] = load_pickle(path_feat_eng)
+    model = load_pickle(path_model)
+    # Parallelism comes from the processes: one model thread each
+    if 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=1)
+    _worker['model'] = model
+
+
+def score_chunk(batch, path_out, id_column='id'):
+    """Cleans, feature engineers and scores a chunk of raw records and
+    writes their predictions to `path_out`. Returns the number of rows"""
+    df = batch.to_pandas()
+    ids = df[id_column].to_numpy()
+    X = transform_raw_records(df, _worker['cleaner'], _worker['feat_eng'])
+    model = _worker['model']
+    features = model_feature_names(model)
+    if features is not None:
+        X = X[features]
+    proba = model.predict_proba(zeros_as_missing(model, X))
+    classes = model.classes_[np.argmax(proba, axis=1)]
+    predictions = pd.DataFrame({id_column: ids,
+                                'probability': proba[:, 1],
+                                'prediction': np.where(classes == 1, 'successful', 'failed')})
+    predictions.to_parquet(path_out, index=False)
+    return len(predictions)
+
+
+def score_file(fname, path_out, paths_pipes, n_workers, chunk_size):
+    """Scores a parquet file chunk by chunk (its row groups, split in
+    chunks of at most `chunk_size` rows) in a process pool. At most two
+    chunks per worker are read ahead, so memory use doesn't depend on
+    the size of the file"""
+    logger = logging.getLogger(__name__)
+    os.makedirs(path_out, exist_ok=True)
+    max_in_flight = 2 * n_workers
+    n_rows, in_flight = 0, set()
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             initializer=init_worker,
+                             initargs=paths_pipes) as executor:
+        batches = pq.ParquetFile(fname).iter_batches(batch_size=chunk_size)
+        for i, batch in enumerate(batches):
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                n_rows += sum(future.result() for future in done)
+            part = f'{path_out}/part-{i:05d}.parquet'
+            in_flight.add(executor.submit(score_chunk, pa.Table.from_batches([batch]), part))
+        n_rows += sum(future.result() for future in wait(in_flight).done)
+    logger.info(f'Scored {n_rows} records of {os.path.basename(fname)}')
+    return n_rows
+
+
+def main(params):
+    """ Scores whole (raw) datasets saved by `downloader` with the fitted
+        cleaning and feat. eng. pipelines and the registered model. The
+        predictions are saved locally (~/data/predictions) as a
+        partitioned parquet dataset (one directory per input file)
+    """
+
+    logger = logging.getLogger(__name__)
+
+    info_data = dict(params["info_data"])
+    info_pipe = dict(params["info_pipe"])
+    n_workers = params["n_workers"] or os.cpu_count()
+
+    # --------------------------------------------- #
+    # Fitted pipelines and registered model (local) #
+    # --------------------------------------------- #
+    path_model = info_pipe["path_model"]
+    if path_model is None:
+        registered = dotenv.get_key(dotenv.find_dotenv(), "WANDB_REGISTERED_MODELS")
+        path_model = f'{info_pipe["path_local_in"]}/{registered}.pkl'
+    paths_pipes = (info_pipe["path_cleaner"], info_pipe["path_feat_eng"], path_model)
+    logger.info(f'Scoring with {os.path.basename(path_model)} ({n_workers} workers)...')
+
+    # ---------------------------- #
+    # Score the datasets by chunks #
+    # ---------------------------- #
+    if info_data["fnames"] is None:
+        fnames = sorted(glob.glob(f'{info_data["path_local_in"]}/{info_data["prefix_name"]}_*.parquet'))
+    else:
+        fnames = [f'{info_data["path_local_in"]}/{fname}' for fname in info_data["fnames"].split(',')]
+    for fname in fnames:
+        name = os.path.basename(fname).replace(info_data["prefix_name"],
+                                               f'{info_data["prefix_name"]}_predictions', 1)
+        path_out = f'{info_data["path_local_out"]}/{name}'
+        logger.info(f'Scoring {os.path.basename(fname)} into {path_out}...')
+        score_file(fname, path_out, paths_pipes,
+                   n_workers, params["chunk_size"])
+
+
+def wrapper_poetry():
+    """ So that we can call this script using Poetry"""
+
+    # -------------- #
+    # Logging config #
+    # -------------- #
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # ------------------------------ #
+    # Load parameters from cli.py #
+    # ------------------------------ #
+    params = gather_batch_score(standalone_mode=False)
+
+    # --------------------------------- #
+    # Score the datasets (process pool) #
+    # --------------------------------- #
+    main(params)
+
+
+if __name__ == '__main__':
+    wrapper_poetry()
@@ -3,14 +3,17 @@ import wandb
 import logging
 from functools import partial
 import dotenv
+import numpy as np
+import scipy.sparse as sp
 
 from cli import gather_train
 from utils.wandb import init_wandb_run, download_wandb_artifact, \
                         configure_sweep, \
                         run_sweep, log_wandb_artifact, \
                         get_artifact_name
-from utils.io import load_data, save_pipe
+from utils.io import load_data, save_pipe, is_sparse_frame
 from utils.aws_s3 import save_to_s3_bucket
+from features.build_features import CATEGORICAL_FEATURES
 
 from xgboost import XGBClassifier
 from lightgbm import LGBMClassifier, log_evaluation
@@ -25,21 +28,41 @@ counter = 0
 
 
 def prepare_data(df_split):
-    """Extract the target column and divide X,y"""
+    """Extract the target column and divide X,y. Sparse data (stored by
+    `build_features --storage sparse`) is divided into CSR matrices, which
+    the models take as they are (without densifying them)"""
     target = 'state'
     keys = ['train', 'val', 'test']
     y = {key: df_split[key][target] for key in keys}
     X = {key: df_split[key].drop(target, axis=1) for key in keys}
+    for key in keys:
+        if is_sparse_frame(df_split[key]):
+            y[key] = y[key].sparse.to_dense()
+            X[key] = X[key].sparse.to_coo().tocsr()
     return X, y
 
 
+def left_out_zeros(X, feature_names):
+    """Features with zeros left out of the CSR matrix X (not stored)"""
+    n_stored = np.bincount(X.indices, minlength=X.shape[1])
+    return [name for name, n in zip(feature_names, n_stored) if n < X.shape[0]]
+
+
+def native_categorical_features(X):
+    """Categorical features kept as integer codes by `build_features`
+    (--categorical native), if any: one-hot encoded ones are named
+    after their categories instead"""
+    columns = getattr(X, 'columns', [])
+    return [col for col in CATEGORICAL_FEATURES if col in columns]
+
+
 def load_yaml(yaml_file):
     with open(yaml_file, 'r') as file:
         sweep_config = yaml.safe_load(file)
     return sweep_config
 
 
-def train_single_sweep(X, y, info_pipe, s3_bucket, seed):
+def train_single_sweep(X, y, info_pipe, s3_bucket, seed, feature_names=None):
 
     global counter
     with init_wandb_run(name_script='sweep', job_type='training', group='sweeps') as run:
@@ -47,6 +70,8 @@ def train_single_sweep(X, y, info_pipe, s3_bucket, seed):
         counter += 1
         run.name = f'{run.name}-{run.id}-{counter}'
         cfg = run.config
+        categorical = native_categorical_features(X['train'])
+        fit_params = {}
 
         if cfg['model_name'] == 'xgboost':
             params = {
@@ -61,6 +86,12 @@ def train_single_sweep(X, y, info_pipe, s3_bucket, seed):
                 'early_stopping_rounds': 40,
                 'seed': seed
             }
+            if categorical:
+                # Codes are split into groups of categories, not as numbers
+                params.update({'tree_method': 'hist',
+                               'enable_categorical': True,
+                               'feature_types': ['c' if col in categorical else 'q'
+                                                 for col in X['train'].columns]})
             model = XGBClassifier(**params)
             callbacks = [WandbCallback()]
 
@@ -81,12 +112,29 @@ def train_single_sweep(X, y, info_pipe, s3_bucket, seed):
             }
             model = LGBMClassifier(**params)
             callbacks = [wandb_callback(), log_evaluation()]
+            if categorical:
+                fit_params['categorical_feature'] = categorical
+            if sp.issparse(X['train']):
+                # CSR matrices carry no column names
+                fit_params['feature_name'] = feature_names
 
         eval_set = [(X['train'], y['train']), (X['val'], y['val'])]
         model.fit(X['train'], y['train'],
                   eval_set=eval_set,
                   eval_metric=['logloss', 'auc'], # <-- AUC is used for early stopping
-                  callbacks=callbacks)
+                  callbacks=callbacks,
+                  **fit_params)
+        if cfg['model_name'] == 'xgboost' and sp.issparse(X['train']):
+            # Same for XGBoost, whose booster takes them once trained
+            model.get_booster().feature_names = feature_names
+            # Zeros left out of the CSR matrix (one-hot features) were read
+            # as missing values, so must they be when scoring dense data
+            # (utils.inference.zeros_as_missing)
+            model.sparse_features_ = left_out_zeros(X['train'], feature_names)
+        if feature_names is not None:
+            # Columns as named in the processed data, to align the features
+            # when scoring (LightGBM replaces spaces in `feature_names_in_`)
+            model.training_features_ = list(feature_names)
 
         keys = ['train','val']
         # predicted value
@@ -157,6 +205,7 @@ def main(params):
 
     logger.info(f'Dividing train/val/test data into features (X) and target (y)...')
     X, y = prepare_data(kicks_split_processed)
+    feature_names = [col for col in kicks_split_processed['train'].columns if col != 'state']
 
     logger.info(f'Defining W&B Sweep Configuration...')
     SWEEP_CONFIG = load_yaml(params['sweep_config'])
@@ -166,7 +215,8 @@ def main(params):
     target_function = partial(train_single_sweep,
                               X=X, y=y, info_pipe=info_pipe,
                               s3_bucket = params["s3_bucket_name"],
-                              seed=params['seed'])
+                              seed=params['seed'],
+                              feature_names=feature_names)
     run_sweep(sweep_id, target_function=target_function, n_sweeps=params['n_sweeps'])
 
     # Store sweep_id in .ENV to be used later (no easy way to access it otherwise)
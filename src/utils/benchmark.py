@@ -0,0 +1,147 @@
+import gc
+import time
+import logging
+import tracemalloc
+import pandas as pd
+
+from cli import gather_benchmark
+from utils.io import load_data
+
+
+# ------------------------------------------------------------ #
+# Wall time and peak memory of (alternative) implementations   #
+# ------------------------------------------------------------ #
+
+def measure(func, *args, repeat=3, **kwargs):
+    """Runs func(*args, **kwargs) and returns its output, the best wall
+    time of `repeat` runs (s) and its peak memory (MB, memory allocated
+    on top of what was in use before the call). Memory is traced in a
+    separate run, since tracing slows the code down"""
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        output = func(*args, **kwargs)
+        seconds.append(time.perf_counter() - start)
+        del output
+    gc.collect()
+    tracemalloc.start()
+    try:
+        output = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return output, min(seconds), peak / 2**20
+
+
+def compare(cases, *args, check=None, repeat=3, **kwargs):
+    """Measures each of the `cases` ({name: func}) on the same inputs and
+    logs a table relative to the first one. `check(expected, output)`
+    (e.g. pd.testing.assert_frame_equal) is called on the output of
+    each case against the first one's"""
+    logger = logging.getLogger(__name__)
+    results, expected = {}, None
+    for name, func in cases.items():
+        output, seconds, peak_mb = measure(func, *args, repeat=repeat, **kwargs)
+        if expected is None:
+            expected = output
+        elif check is not None:
+            check(expected, output)
+        results[name] = {'seconds': seconds, 'peak_mb': peak_mb}
+        del output
+
+    baseline = next(iter(results.values()))
+    logger.info(f'{"case":<20}{"time (s)":>12}{"speedup":>10}{"peak (MB)":>12}{"memory":>10}')
+    for name, result in results.items():
+        logger.info(f'{name:<20}{result["seconds"]:>12.3f}'
+                    f'{baseline["seconds"] / result["seconds"]:>9.1f}x'
+                    f'{result["peak_mb"]:>12.1f}'
+                    f'{result["peak_mb"] / baseline["peak_mb"]:>9.2f}x')
+    return results
+
+
+# ---------- #
+# Benchmarks #
+# ---------- #
+
+def benchmark_cleaning(df, repeat):
+    """Step-by-step vs fused cleaning pipeline (data/cleaner.py)"""
+    from data.cleaner import create_cleaning_pipeline, \
+                             COLS_TO_DROP_MISSING, COLS_TO_DROP_IRR, \
+                             ID_COLUMN, DATE_COLUMNS
+
+    def clean(fused):
+        pipe = create_cleaning_pipeline(COLS_TO_DROP_MISSING + COLS_TO_DROP_IRR,
+                                        ID_COLUMN, DATE_COLUMNS, fused=fused)
+        return lambda X: pipe.fit_transform(X)
+
+    return compare({'step-by-step': clean(False),
+                    'fused': clean(True)},
+                   df, check=pd.testing.assert_frame_equal, repeat=repeat)
+
+
+def benchmark_word_count(df, repeat):
+    """str.split() word counts vs Arrow (utils/pipelines.py), of the
+    names and descriptions"""
+    from utils.pipelines import count_words
+
+    def split_words(X):
+        return [X[column].str.split().str.len() for column in ['name', 'blurb']]
+
+    def arrow_words(X):
+        return [count_words(X[column]) for column in ['name', 'blurb']]
+
+    def check(expected, output):
+        for left, right in zip(expected, output):
+            pd.testing.assert_series_equal(left, right, check_names=False)
+
+    return compare({'str.split': split_words,
+                    'arrow': arrow_words},
+                   df, check=check, repeat=repeat)
+
+
+BENCHMARKS = {'cleaning': benchmark_cleaning,
+              'word_count': benchmark_word_count}
+# Raw columns each benchmark reads (None: all of them)
+BENCHMARK_COLUMNS = {'cleaning': None,
+                     'word_count': ['name', 'blurb']}
+
+
+def main(params):
+    """ Benchmarks the wall time and peak memory of alternative
+        implementations of a step (checking that their outputs are
+        identical) on a raw snapshot saved locally by `downloader`
+    """
+
+    logger = logging.getLogger(__name__)
+
+    info_data = dict(params["info_data"])
+    logger.info(f'Loading raw data to Pandas...')
+    kicks, _, _ = load_data(info_data, is_split=False,
+                            columns=BENCHMARK_COLUMNS[params["target"]])
+    logger.info(f'Benchmarking {params["target"]} on {len(kicks["full"])} rows...')
+    BENCHMARKS[params["target"]](kicks['full'], params["repeat"])
+
+
+def wrapper_poetry():
+    """ So that we can call this script using Poetry"""
+
+    # -------------- #
+    # Logging config #
+    # -------------- #
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # ------------------------------ #
+    # Load parameters from cli.py #
+    # ------------------------------ #
+    params = gather_benchmark(standalone_mode=False)
+
+    # -------------- #
+    # Run benchmarks #
+    # -------------- #
+    main(params)
+
+
+if __name__ == '__main__':
+    wrapper_poetry()
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import shutil
+import pickle
+import hashlib
+import logging
+
+
+# ------------------------------------------------------------ #
+# On-disk cache of the fitted pipelines and outputs of stages  #
+# ------------------------------------------------------------ #
+
+# Bump it when the transformations change, so that older entries are
+# no longer used
+CACHE_VERSION = 2
+
+
+class PipelineCache:
+    """
+    Fitted pipeline and output files of a stage (`cleaner`,
+    `build_features`), keyed on the SHA-256 of its input files (see
+    `data_checksums`) and its parameters. Re-running a stage on unchanged
+    input restores them instead of fitting and transforming again. Each
+    entry is a directory (`<path>/<key>`), and once the cache takes more
+    than `max_bytes` the least recently used entries are evicted.
+
+        cache = PipelineCache('cleaner', path, max_bytes)
+        key = cache.key(data_checksums(info_data), params)
+        cached = cache.restore(key, path_out)  # (pipe, fnames) or None
+        ...
+        cache.store(key, pipe, path_out, fnames_out)
+    """
+
+    def __init__(self, stage, path, max_bytes):
+        self.stage = stage
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, checksums, params):
+        """Key of a run of the stage on inputs with the given `checksums`
+        ({split: SHA-256}) and `params` (JSON serializable)"""
+        content = json.dumps({'stage': self.stage, 'version': CACHE_VERSION,
+                              'inputs': checksums, 'params': params},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def _entry(self, key):
+        return f'{self.path}/{key}'
+
+    def restore(self, key, path_out):
+        """Copies the output files of the entry into `path_out` and
+        returns its fitted pipeline and file names (None if missed)"""
+        logger = logging.getLogger(__name__)
+        path_entry = self._entry(key)
+        try:
+            with open(f'{path_entry}/entry.json', 'r') as f:
+                entry = json.load(f)
+            with open(f'{path_entry}/pipe.pkl', 'rb') as f:
+                pipe = pickle.load(f)
+            for fname in entry['fnames']:
+                shutil.copyfile(f'{path_entry}/{fname}', f'{path_out}/{fname}')
+        except (OSError, ValueError, KeyError, AttributeError, ImportError,
+                pickle.UnpicklingError):
+            logger.info(f'Cache miss for {self.stage} ({key[:12]})')
+            return None
+        # Recently used entries are evicted last
+        os.utime(f'{path_entry}/entry.json')
+        logger.info(f'Cache hit for {self.stage} ({key[:12]}): '
+                    f'restored {len(entry["fnames"])} files into {path_out}')
+        return pipe, list(entry['fnames'])
+
+    def store(self, key, pipe, path_out, fnames):
+        """Adds the fitted pipeline and output files (`fnames` in
+        `path_out`) of a stage run, then evicts entries over the size"""
+        logger = logging.getLogger(__name__)
+        path_entry = self._entry(key)
+        path_tmp = f'{path_entry}.tmp-{os.getpid()}'
+        shutil.rmtree(path_tmp, ignore_errors=True)
+        os.makedirs(path_tmp)
+        for fname in fnames:
+            shutil.copyfile(f'{path_out}/{fname}', f'{path_tmp}/{fname}')
+        with open(f'{path_tmp}/pipe.pkl', 'wb') as f:
+            pickle.dump(pipe, f)
+        with open(f'{path_tmp}/entry.json', 'w') as f:
+            json.dump({'stage': self.stage, 'fnames': list(fnames), 'created': time.time()}, f)
+        # The entry only appears once complete
+        shutil.rmtree(path_entry, ignore_errors=True)
+        os.replace(path_tmp, path_entry)
+        logger.info(f'Cached {self.stage} ({key[:12]}) in {self.path}')
+        self.evict()
+
+    def _entries(self):
+        """(last used, size, key) of each complete entry"""
+        entries = []
+        for key in os.listdir(self.path):
+            if '.tmp-' in key:
+                continue
+            path_entry = self._entry(key)
+            try:
+                last_used = os.path.getmtime(f'{path_entry}/entry.json')
+            except OSError:
+                continue
+            size = sum(os.path.getsize(f'{path_entry}/{fname}') for fname in os.listdir(path_entry))
+            entries.append((last_used, size, key))
+        return sorted(entries)
+
+    def evict(self):
+        """Removes the least recently used entries until the cache takes
+        at most `max_bytes` (the most recently used one is always kept)"""
+        logger = logging.getLogger(__name__)
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+            logger.info(f'Evicted {key[:12]} from the cache ({size / 2**20:.1f} MB)')
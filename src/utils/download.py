@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ------------------------------------------------------------ #
+# Resumable (HTTP Range) and checksummed downloads             #
+# ------------------------------------------------------------ #
+
+class DownloadError(Exception):
+    """Raised when a download can't be completed or verified"""
+
+
+def _conditional_headers(url, snapshot):
+    headers = {}
+    if snapshot and snapshot.get('url') == url:
+        if snapshot.get('etag'):
+            headers['If-None-Match'] = snapshot['etag']
+        if snapshot.get('last_modified'):
+            headers['If-Modified-Since'] = snapshot['last_modified']
+    return headers
+
+
+def _expected_digest(headers):
+    """SHA-256 announced by the server (`Digest: sha-256=<base64>`), if any"""
+    for value in headers.get('Digest', '').split(','):
+        algorithm, _, digest = value.strip().partition('=')
+        if algorithm.lower() == 'sha-256' and digest:
+            return base64.b64decode(digest).hex()
+    return None
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class _Progress:
+    """Bytes downloaded of each range, persisted next to the file
+    (`<path>.progress.json`) so that an interrupted download resumes"""
+
+    def __init__(self, path, remote, ranges):
+        self.path = path
+        self.remote = remote
+        self.ranges = ranges
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, remote, n_ranges):
+        """Progress of a previous download of the same remote file, or a
+        new one (with `n_ranges` ranges) otherwise"""
+        try:
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            if saved['remote'] == remote:
+                return cls(path, remote, saved['ranges'])
+        except (OSError, ValueError, KeyError):
+            pass
+        size = remote['size']
+        step = max(1, -(-size // n_ranges))
+        ranges = [[start, min(start + step, size) - 1, 0]
+                  for start in range(0, size, step)]
+        return cls(path, remote, ranges)
+
+    @property
+    def done(self):
+        return all(done == end - start + 1 for start, end, done in self.ranges)
+
+    def advance(self, i, n_bytes):
+        with self._lock:
+            self.ranges[i][2] += n_bytes
+            self.save()
+
+    def save(self):
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump({'remote': self.remote, 'ranges': self.ranges}, f)
+        os.replace(f'{self.path}.tmp', self.path)
+
+
+def _fetch_range(url, path, progress, i, validator,
+                 chunk_size, max_retries, timeout):
+    """Downloads (what's left of) the i-th range into its place of the file"""
+    logger = logging.getLogger(__name__)
+    start, end, _ = progress.ranges[i]
+    attempt = 0
+    while True:
+        offset = start + progress.ranges[i][2]
+        if offset > end:
+            return
+        headers = {'Range': f'bytes={offset}-{end}'}
+        if validator:
+            # The server sends the whole file (200) if it changed meanwhile
+            headers['If-Range'] = validator
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=timeout) as r:
+                if r.status_code != 206:
+                    raise DownloadError(f'Range request answered with {r.status_code} '
+                                        f'(the file changed on the server?)')
+                with open(path, 'r+b') as f:
+                    f.seek(offset)
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        chunk = chunk[:end + 1 - offset]
+                        f.write(chunk)
+                        f.flush()
+                        offset += len(chunk)
+                        progress.advance(i, len(chunk))
+            if offset > end:
+                return
+            error = 'connection closed'
+        except (requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            error = e
+        attempt += 1
+        if attempt > max_retries:
+            raise DownloadError(f'Range {start}-{end} failed after {max_retries} retries: {error}')
+        logger.warning(f'Range {start}-{end} interrupted at byte {offset}, resuming ({error})')
+        time.sleep(min(2 ** attempt, 30))
+
+
+def download_resumable(url, path,
+                       snapshot=None,
+                       n_ranges=1,
+                       expected_sha256=None,
+                       chunk_size=1 << 20,
+                       max_retries=5,
+                       timeout=60):
+    """Downloads `url` into `path`, resuming a previous partial download
+    of the same remote file (same size, ETag and Last-Modified) with HTTP
+    Range requests. The file can be downloaded as `n_ranges` ranges in
+    parallel. Once complete, its size and SHA-256 (against
+    `expected_sha256` and/or the server's `Digest` header) are checked.
+
+    As `download_to_file`, returns the state of the download (URL, ETag,
+    Last-Modified, SHA-256) or None if `snapshot` (the state of a previous
+    download) is of the same URL and the server says it hasn't changed"""
+    logger = logging.getLogger(__name__)
+    r = requests.head(url, headers=_conditional_headers(url, snapshot),
+                      allow_redirects=True, timeout=timeout)
+    if r.status_code == 304:
+        return None
+    r.raise_for_status()
+    remote = {'url': url,
+              'etag': r.headers.get('ETag'),
+              'last_modified': r.headers.get('Last-Modified'),
+              'size': int(r.headers.get('Content-Length', -1))}
+    expected_sha256 = expected_sha256 or _expected_digest(r.headers)
+    path_progress = f'{path}.progress.json'
+
+    if r.headers.get('Accept-Ranges') != 'bytes' or remote['size'] < 0:
+        # No ranges (or unknown size): plain download, from the start
+        logger.info(f'{url} does not support range requests, downloading it whole')
+        with requests.get(url, stream=True, timeout=timeout) as r, open(path, 'wb') as f:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+        remote['size'] = os.path.getsize(path)
+        progress = _Progress(path_progress, remote, [[0, remote['size'] - 1, remote['size']]])
+    else:
+        progress = _Progress.load(path_progress, remote, max(1, n_ranges))
+        if not os.path.exists(path) or os.path.getsize(path) != remote['size']:
+            if any(done for _, _, done in progress.ranges):
+                logger.warning(f'{path} does not match its progress, starting over')
+            progress = _Progress(path_progress, remote, [[start, end, 0] for start, end, _ in progress.ranges])
+            with open(path, 'wb') as f:
+                f.truncate(remote['size'])
+        pending = [i for i, (start, end, done) in enumerate(progress.ranges) if done < end - start + 1]
+        if pending:
+            downloaded = sum(done for _, _, done in progress.ranges)
+            if downloaded:
+                logger.info(f'Resuming {os.path.basename(path)} at {downloaded}/{remote["size"]} bytes')
+            progress.save()
+            # If-Range only takes strong ETags
+            etag = remote['etag']
+            validator = etag if etag and not etag.startswith('W/') else remote['last_modified']
+            with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                futures = [executor.submit(_fetch_range, url, path, progress, i, validator,
+                                           chunk_size, max_retries, timeout)
+                           for i in pending]
+                for future in futures:
+                    future.result()
+
+    # Integrity checks
+    if os.path.getsize(path) != remote['size'] or not progress.done:
+        raise DownloadError(f'{path} is incomplete ({os.path.getsize(path)}/{remote["size"]} bytes)')
+    sha256 = file_sha256(path)
+    if expected_sha256 is not None and sha256 != expected_sha256.lower():
+        remove_download(path)
+        raise DownloadError(f'Checksum mismatch for {url}: {sha256} != {expected_sha256}')
+    progress.save()
+    return {'url': url,
+            'etag': remote['etag'],
+            'last_modified': remote['last_modified'],
+            'sha256': sha256}
+
+
+def remove_download(path):
+    """Removes a downloaded file and its progress"""
+    for fname in (path, f'{path}.progress.json'):
+        if os.path.exists(fname):
+            os.remove(fname)
@@ -0,0 +1,299 @@
+import math
+import numpy as np
+
+from sklearn.preprocessing import OrdinalEncoder
+
+from utils.pipelines import parse_category, \
+                            calculate_usd_goal, \
+                            calculate_name_length, \
+                            calculate_description_length, \
+                            calculate_creation_to_launch_hours, \
+                            calculate_campaign_hours, \
+                            turn_to_log
+
+
+# ------------------------------------------------------------ #
+# Raw records -> features, using the fitted sklearn pipelines  #
+# ------------------------------------------------------------ #
+
+def expected_raw_columns(cleaner_pipe):
+    """Raw columns the fitted cleaning pipeline expects as input"""
+    if 'fused_cleaner' in cleaner_pipe.named_steps:
+        return list(cleaner_pipe.named_steps['fused_cleaner'].feature_names_in_)
+    dropped = list(cleaner_pipe.named_steps['column_dropper'].columns)
+    kept = list(cleaner_pipe.named_steps['category_transformer'].feature_names_in_)
+    return dropped + kept
+
+
+def model_feature_names(model):
+    """Names of the features the model was trained with (in order), or
+    None if unknown. Those recorded by `train` come first: LightGBM
+    replaces spaces in `feature_names_in_`, and models fitted on CSR
+    matrices have none"""
+    names = getattr(model, 'training_features_', None)
+    if names is None:
+        names = getattr(model, 'feature_names_in_', None)
+    return None if names is None else [str(name) for name in names]
+
+
+def zeros_as_missing(model, X):
+    """X (DataFrame or array of the model's features, in order) with
+    the zeros of `sparse_features_` as NaN: XGBoost read those features'
+    zeros, left out of its sparse training data, as missing values"""
+    features = getattr(model, 'sparse_features_', None)
+    if not features:
+        return X
+    if hasattr(X, 'columns'):
+        X = X.copy()
+        X[features] = X[features].where(X[features] != 0)
+        return X
+    names = model_feature_names(model)
+    positions = [names.index(name) for name in features]
+    X = X.astype(np.promote_types(X.dtype, np.float32))
+    block = X[:, positions]
+    block[block == 0] = np.nan
+    X[:, positions] = block
+    return X
+
+
+def transform_raw_records(df, cleaner_pipe, engineer_pipe, target='state'):
+    """Cleans and feature engineers raw records (one per row of df) and
+    returns the features fed to the model, in the same order"""
+    # Fields missing in the records are considered null
+    df = df.reindex(columns=expected_raw_columns(cleaner_pipe))
+    # The target is unknown when serving, but the pipeline encodes it
+    encoder = engineer_pipe.named_steps['scale_and_encode'].named_transformers_['target_encoder']
+    df[target] = encoder.categories_[0][0]
+    for name, step in cleaner_pipe.steps:
+        # Records are scored independently, even if they share an 'id'
+        if name == 'fused_cleaner':
+            df = step.clean(df, drop_duplicates=False)
+        elif name != 'row_dropper':
+            df = step.transform(df)
+    df = engineer_pipe.transform(df)
+    return df.drop(target, axis=1)
+
+
+# ------------------------------------------------------------ #
+# Raw records -> features, precompiled (plain Python / NumPy)  #
+# ------------------------------------------------------------ #
+
+NS_PER_SECOND = 10**9
+NS_PER_HOUR = 3600 * NS_PER_SECOND
+NS_PER_DAY = 24 * NS_PER_HOUR
+
+
+def _is_null(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _to_ns(seconds):
+    """Same conversion as pd.to_datetime(seconds, origin='unix', unit='s')"""
+    if isinstance(seconds, (int, np.integer)):
+        return int(seconds) * NS_PER_SECOND
+    base = int(seconds)
+    frac = round(seconds - base, 9)
+    return base * NS_PER_SECOND + int(frac * NS_PER_SECOND)
+
+
+def _round_half_even(ns, unit):
+    """Same rounding as pandas Timedelta.round (ties to even)"""
+    quotient, remainder = divmod(ns, unit)
+    if remainder > unit // 2 or (remainder == unit // 2 and quotient % 2):
+        quotient += 1
+    return quotient
+
+
+def _word_count(text):
+    return len(text.split()) if isinstance(text, str) else np.nan
+
+
+class CompiledPipeline:
+    """
+    Reproduces the output of the fitted cleaning + feat. eng. pipelines
+    for a single raw record, without building DataFrames: the fitted
+    state (medians, scaler statistics and one-hot or ordinal
+    vocabularies) is extracted once into plain dicts and arrays.
+    """
+
+    def __init__(self, date_columns, medians, log_columns,
+                 categorical, numerical, mean, scale, feature_names,
+                 default_median=np.nan, ordinal=()):
+        self.date_columns = date_columns
+        # {'main_category': {category: median}, 'sub_category': {...}}
+        self.medians = medians
+        # Median of categories not seen in training
+        self.default_median = default_median
+        self.log_columns = log_columns
+        # [(column, {category: output position}), ...]
+        self.categorical = categorical
+        # [(column, output position, {category: code}), ...]
+        self.ordinal = ordinal
+        # [(column, output position), ...]
+        self.numerical = numerical
+        self.mean = mean
+        self.scale = scale
+        self.feature_names = feature_names
+
+    def _numerical_values(self, record):
+        created_at, launched_at, deadline = (None if _is_null(record.get(col)) else _to_ns(record[col])
+                                             for col in self.date_columns)
+        main_category, sub_category = parse_category(record['category'])
+        usd_goal = record['goal'] * record['static_usd_rate']
+        median_main = self.medians['main_category'].get(main_category, self.default_median)
+        median_sub = self.medians['sub_category'].get(sub_category, self.default_median)
+
+        values = {
+            'name_length': _word_count(record.get('name')),
+            'description_length': _word_count(record.get('blurb')),
+            'usd_goal': usd_goal,
+            'diff_main_category_goal': abs(usd_goal - median_main),
+            'diff_sub_category_goal': abs(usd_goal - median_sub),
+            'creation_to_launch_hours': np.nan,
+            'campaign_hours': np.nan,
+        }
+        if _is_null(values['description_length']):
+            values['description_length'] = 0
+        if created_at is not None and launched_at is not None:
+            values['creation_to_launch_hours'] = float(
+                _round_half_even(launched_at - created_at, NS_PER_HOUR))
+        if launched_at is not None and deadline is not None:
+            values['campaign_hours'] = float(
+                24 * _round_half_even(deadline - launched_at, NS_PER_DAY))
+        categories = {'main_category': main_category,
+                      'sub_category': sub_category}
+        return values, categories
+
+    def transform_records(self, records):
+        """Features of several raw records (dicts), one row per record"""
+        records = list(records)
+        X = np.zeros((len(records), len(self.feature_names)))
+        numerical = np.empty((len(records), len(self.numerical)))
+        for i, record in enumerate(records):
+            values, categories = self._numerical_values(record)
+            for column, positions in self.categorical:
+                value = categories[column] if column in categories else record.get(column)
+                position = positions.get(value)
+                # Unknown categories are ignored (all zeros), as in the OneHotEncoder
+                if position is not None:
+                    X[i, position] = 1.
+            for column, position, codes in self.ordinal:
+                value = categories[column] if column in categories else record.get(column)
+                # Unknown (or missing) categories are NaN, as in the OrdinalEncoder
+                X[i, position] = codes.get(value, np.nan)
+            numerical[i] = [values[column] for column, _ in self.numerical]
+        # Log transformation and scaling, column-wise like the pipeline
+        for j, (column, _) in enumerate(self.numerical):
+            if column in self.log_columns:
+                numerical[:, j] = np.log1p(numerical[:, j])
+        numerical -= self.mean
+        numerical /= self.scale
+        X[:, [position for _, position in self.numerical]] = numerical
+        return X
+
+    def transform_record(self, record):
+        """Features of a single raw record (dict)"""
+        return self.transform_records([record])[0]
+
+
+def _function_of(transformer):
+    return getattr(transformer, 'func', None)
+
+
+def compile_pipelines(cleaner_pipe, engineer_pipe, target='state'):
+    """Extracts the fitted state of the cleaning and feat. eng. pipelines
+    into a CompiledPipeline. Raises ValueError if the pipelines don't
+    have the structure built by `create_cleaning_pipeline` and
+    `create_feat_eng_pipeline`"""
+    try:
+        if 'fused_cleaner' in cleaner_pipe.named_steps:
+            date_columns = cleaner_pipe.named_steps['fused_cleaner'].date_columns
+            usd = None
+        else:
+            date_columns = cleaner_pipe.named_steps['date_transformer'].kw_args['columns']
+            usd = cleaner_pipe.named_steps['usd_conversion'].named_transformers_
+        sentence = engineer_pipe.named_steps['sentence_length'].named_transformers_
+        time = engineer_pipe.named_steps['time_duration'].named_transformers_
+        median_diff = engineer_pipe.named_steps['median_diff']
+        medians = median_diff.medians
+        log_converter = engineer_pipe.named_steps['log_converter']
+        scale_and_encode = engineer_pipe.named_steps['scale_and_encode']
+    except (KeyError, AttributeError) as e:
+        raise ValueError(f'Unexpected pipeline structure: {e!r}')
+
+    # (the fused cleaner computes 'usd_goal' as `calculate_usd_goal` does)
+    expected = [] if usd is None else [(usd['usd_goal'], calculate_usd_goal)]
+    expected += [(sentence['name_length'], calculate_name_length),
+                 (sentence['description_length'], calculate_description_length),
+                 (time['creation_to_launch_hours'], calculate_creation_to_launch_hours),
+                 (time['campaign_hours'], calculate_campaign_hours),
+                 (log_converter.named_transformers_['log_scaled'], turn_to_log)]
+    if any(_function_of(step) is not func for step, func in expected):
+        raise ValueError('Unexpected transformer functions in the pipelines')
+    if sorted(date_columns) != ['created_at', 'deadline', 'launched_at']:
+        raise ValueError(f'Unexpected date columns: {date_columns}')
+    date_columns = ['created_at', 'launched_at', 'deadline']
+
+    log_columns = [cols for name, _, cols in log_converter.transformers_
+                   if name == 'log_scaled'][0]
+
+    # Output layout of the last ColumnTransformer
+    position = 0
+    categorical, ordinal, numerical, mean, scale = [], [], [], [], []
+    for name, transformer, columns in scale_and_encode.transformers_:
+        if transformer == 'drop' or name == 'remainder':
+            continue
+        if name == 'categorical_encoder' and isinstance(transformer, OrdinalEncoder):
+            # Integer codes (build_features --categorical native)
+            if transformer.handle_unknown != 'use_encoded_value' \
+                    or not _is_null(transformer.unknown_value) \
+                    or not _is_null(transformer.encoded_missing_value):
+                raise ValueError('OrdinalEncoder must encode unknown/missing categories as NaN')
+            for column, categories in zip(columns, transformer.categories_):
+                ordinal.append((column, position, {category: float(i)
+                                                   for i, category in enumerate(categories)
+                                                   if not _is_null(category)}))
+                position += 1
+        elif name == 'categorical_encoder':
+            if transformer.drop_idx_ is not None:
+                raise ValueError('OneHotEncoder with `drop` is not supported')
+            for column, categories in zip(columns, transformer.categories_):
+                categorical.append((column, {category: position + i
+                                             for i, category in enumerate(categories)}))
+                position += len(categories)
+        elif name == 'numerical_scaler':
+            n = len(columns)
+            numerical += [(column, position + i) for i, column in enumerate(columns)]
+            mean.append(transformer.mean_ if transformer.with_mean else np.zeros(n))
+            scale.append(transformer.scale_ if transformer.with_std else np.ones(n))
+            position += n
+        elif name == 'target_encoder':
+            # The target is not a feature, it's dropped before scoring
+            if list(columns) != [target]:
+                raise ValueError(f'Unexpected target columns: {columns}')
+            target_position = position
+            position += 1
+        else:
+            raise ValueError(f'Unexpected transformer: {name}')
+
+    feature_names = list(scale_and_encode.get_feature_names_out())
+    if len(feature_names) != position:
+        raise ValueError('Could not reproduce the layout of the features')
+    # Positions after the target move one place up
+    del feature_names[target_position]
+    shift = lambda p: p - 1 if p > target_position else p
+    categorical = [(column, {k: shift(p) for k, p in positions.items()})
+                   for column, positions in categorical]
+    ordinal = [(column, shift(p), codes) for column, p, codes in ordinal]
+    numerical = [(column, shift(p)) for column, p in numerical]
+
+    return CompiledPipeline(date_columns=date_columns,
+                            medians={key: value.to_dict() for key, value in medians.items()},
+                            log_columns=set(log_columns),
+                            categorical=categorical,
+                            ordinal=ordinal,
+                            numerical=numerical,
+                            mean=np.concatenate(mean),
+                            scale=np.concatenate(scale),
+                            feature_names=feature_names,
+                            default_median=getattr(median_diff, 'global_median_', np.nan))
@@ -1,26 +1,170 @@
+import os
 import re
 import glob
+import json
 import pickle
+import zipfile
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from utils.download import file_sha256
+
+
+def map_concurrently(func, *iterables, concurrency='serial'):
+    """list(map(func, *iterables)), with one worker per item on a thread
+    or process pool (concurrency='thread' or 'process'). With processes,
+    func and the items must be picklable. With a single CPU there's
+    nothing to gain, so items are always mapped serially"""
+    items = list(zip(*iterables))
+    executors = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+    if concurrency != 'serial' and concurrency not in executors:
+        raise ValueError(f"Unknown concurrency: {concurrency} (use 'serial', 'thread' or 'process')")
+    if concurrency == 'serial' or len(items) < 2 or (os.cpu_count() or 1) < 2:
+        return [func(*item) for item in items]
+    with executors[concurrency](max_workers=len(items)) as executor:
+        return list(executor.map(func, *zip(*items)))
+
+
+# ------------------------------------------------------------ #
+# Storage of the (processed) data: dense, float32 or sparse    #
+# ------------------------------------------------------------ #
+
+# 'dense': as is (.parquet), 'float32': every column cast to float32
+# (.parquet), 'sparse': float32 CSR matrix (.npz), for one-hot features
+# (the zeros of the other columns are stored explicitly, see `to_csr`)
+STORAGES = ['dense', 'float32', 'sparse']
+EXTENSIONS = {'dense': 'parquet', 'float32': 'parquet', 'sparse': 'npz'}
+
+
+def _check_storage(storage):
+    if storage not in STORAGES:
+        raise ValueError(f"Unknown storage: {storage} (use {', '.join(map(repr, STORAGES))})")
+
+
+def to_csr(df, dense_columns=()):
+    """Float32 CSR matrix of a (numerical) DataFrame, built column by
+    column so that the whole frame is never copied densely. Zeros are
+    left out (NaNs are kept), except in `dense_columns`: XGBoost reads
+    left out entries as missing values, so real zeros must be stored"""
+    dense_columns = set(dense_columns)
+    data, indices, counts = [], [], []
+    for column in df.columns:
+        values = df[column].to_numpy(dtype=np.float32)
+        rows = np.arange(len(values)) if column in dense_columns else np.flatnonzero(values)
+        data.append(values[rows])
+        indices.append(rows)
+        counts.append(len(rows))
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    data = np.concatenate(data) if data else np.empty(0, dtype=np.float32)
+    indices = np.concatenate(indices) if indices else np.empty(0, dtype=np.int64)
+    return sp.csc_matrix((data, indices, indptr), shape=df.shape).tocsr()
+
+
+def save_sparse(matrix, path, columns, index):
+    """Saves a CSR matrix with its column names and index (compressed
+    .npz, also readable by scipy.sparse.load_npz)"""
+    np.savez_compressed(path, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+                        format=np.array('csr'), shape=np.array(matrix.shape),
+                        columns=np.array(list(columns), dtype=str), index=np.asarray(index))
+
+
+def load_sparse(path):
+    """DataFrame of sparse (float32) columns of a file of `save_sparse`"""
+    with np.load(path, allow_pickle=False) as f:
+        matrix = sp.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+        columns, index = f['columns'].tolist(), f['index']
+    df = pd.DataFrame.sparse.from_spmatrix(matrix, index=index, columns=columns)
+    # Left out entries are zeros (the fill value isn't 0 for floats in every pandas version)
+    return df.astype(pd.SparseDtype(np.float32, 0))
+
+
+def is_sparse_frame(df):
+    return len(df.columns) > 0 and all(isinstance(dtype, pd.SparseDtype) for dtype in df.dtypes)
+
+
+def _save(df, path, storage='dense', dense_columns=()):
+    if storage == 'sparse':
+        save_sparse(to_csr(df, dense_columns), path, df.columns, df.index)
+    elif storage == 'float32':
+        df.astype(np.float32).to_parquet(path)
+    else:
+        df.to_parquet(path)
+
+
+def _range_index(pf, row_groups):
+    """Index that pd.read_parquet gives the rows of some row groups of a
+    file saved with a RangeIndex (None otherwise)"""
+    index = ((pf.schema_arrow.pandas_metadata or {}).get('index_columns') or [None])[0]
+    if not isinstance(index, dict) or index.get('kind') != 'range':
+        return None
+    offsets = np.cumsum([0] + [pf.metadata.row_group(i).num_rows for i in range(pf.num_row_groups)])
+    positions = np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in row_groups])
+    return pd.Index(index['start'] + index['step'] * positions, name=index.get('name'))
+
+
+def sort_categories(df):
+    """Sorts the categories of the (unordered) categorical columns of
+    df, which otherwise come in the order the file was written in (e.g.
+    first appearance, batch by batch, when streamed)"""
+    for name in df.columns:
+        if isinstance(df[name].dtype, pd.CategoricalDtype) and not df[name].cat.ordered:
+            df[name] = df[name].cat.reorder_categories(sorted(df[name].cat.categories))
+    return df
+
+
+def _read(fname, columns=None, row_groups=None):
+    if fname.endswith('.npz'):
+        if row_groups is not None:
+            raise ValueError(f'Row groups can only be selected in .parquet files, not {fname}')
+        df = load_sparse(fname)
+        return df if columns is None else df[columns]
+    if row_groups is None:
+        return sort_categories(pd.read_parquet(fname, engine='pyarrow', columns=columns))
+    pf = pq.ParquetFile(fname)
+    df = pf.read_row_groups(row_groups, columns=columns, use_pandas_metadata=True).to_pandas()
+    index = _range_index(pf, row_groups)
+    if index is not None:
+        df.index = index
+    return sort_categories(df)
 
 
 def save_data(df, info_data,
               year, month,
-              is_split=False):
+              is_split=False,
+              concurrency='serial',
+              storage='dense',
+              dense_columns=()):
+    _check_storage(storage)
+    extension = EXTENSIONS[storage]
     if is_split:
-        fnames = []
+        fnames, values = [], []
         for key, value in df.items():
             if value is not None:
-                fname = f'{info_data["prefix_name"]}_{key}_{month}-{year}.parquet'
-                value.to_parquet(f'{info_data["path_local_out"]}/{fname}')
-                fnames.append(fname)
+                fnames.append(f'{info_data["prefix_name"]}_{key}_{month}-{year}.{extension}')
+                values.append(value)
+        # The splits are written concurrently, if asked to
+        map_concurrently(_save, values,
+                         [f'{info_data["path_local_out"]}/{fname}' for fname in fnames],
+                         [storage] * len(values),
+                         [dense_columns] * len(values),
+                         concurrency=concurrency)
         info_data["fnames"] = fnames
+        keys = [key for key, value in df.items() if value is not None]
     else:
-        fname = f'{info_data["prefix_name"]}_{month}-{year}.parquet'
-        df.to_parquet(f'{info_data["path_local_out"]}/{fname}')
+        fname = f'{info_data["prefix_name"]}_{month}-{year}.{extension}'
+        _save(df, f'{info_data["path_local_out"]}/{fname}', storage, dense_columns)
         info_data['fnames'] = [fname]
+        keys = ['full']
 
-    return info_data
+    return write_manifest(info_data, year, month,
+                          dict(zip(keys, info_data["fnames"])))
 
 
 def save_pipe(pipe, info_pipe, suffix=None):
@@ -36,23 +180,488 @@ def save_pipe(pipe, info_pipe, suffix=None):
     return info_pipe
 
 
-def load_data(info_data, is_split=False):
-    fnames = glob.glob(f'{info_data["path_local_in"]}/*.parquet')
+# ------------------------------------------------------------ #
+# Dataset manifest (splits, schema, layout and checksums)      #
+# ------------------------------------------------------------ #
+
+def manifest_fname(prefix_name):
+    return f'{prefix_name}_manifest.json'
+
+
+def describe_file(path):
+    """Rows, schema, row groups (rows of each one), size, modification
+    time and SHA-256 of a saved .parquet (or .npz) file"""
+    if path.endswith('.npz'):
+        with np.load(path, allow_pickle=False) as f:
+            rows = int(f['shape'][0])
+            schema = [{'name': name, 'type': 'float32'} for name in f['columns'].tolist()]
+        row_groups = None
+    else:
+        pf = pq.ParquetFile(path)
+        rows = pf.metadata.num_rows
+        schema = [{'name': field.name, 'type': str(field.type)} for field in pf.schema_arrow]
+        row_groups = [pf.metadata.row_group(i).num_rows for i in range(pf.num_row_groups)]
+    stat = os.stat(path)
+    return {'rows': rows, 'schema': schema, 'row_groups': row_groups,
+            'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_sha256(path)}
+
+
+def write_manifest(info_data, year, month, fnames):
+    """Writes the manifest (`<prefix_name>_manifest.json`) of the files
+    just saved in `path_local_out` ({split: fname}), and adds it to
+    info_data["fnames"] so that it travels with them (S3, W&B)"""
+    manifest = {'prefix_name': info_data["prefix_name"],
+                'year': year,
+                'month': month,
+                'splits': {key: {'fname': fname,
+                                 **describe_file(f'{info_data["path_local_out"]}/{fname}')}
+                           for key, fname in fnames.items()}}
+    fname = manifest_fname(info_data["prefix_name"])
+    path = f'{info_data["path_local_out"]}/{fname}'
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f'{path}.tmp', path)
+    info_data["fnames"] = [name for name in info_data["fnames"] if name != fname] + [fname]
+    return info_data
+
+
+def read_manifest(info_data):
+    """Manifest of the data in `path_local_in` (None if there's none)"""
+    if info_data.get("prefix_name") is None:
+        return None
+    path = f'{info_data["path_local_in"]}/{manifest_fname(info_data["prefix_name"])}'
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def restore_mtimes(info_data):
+    """Gives the files just downloaded into `path_local_in` (e.g. from S3)
+    the modification time their manifest records, if they have the size
+    it records too. Downloads are otherwise newer than the manifest"""
+    manifest = read_manifest(info_data)
+    if manifest is None:
+        return
+    for split in manifest['splits'].values():
+        path = f'{info_data["path_local_in"]}/{split["fname"]}'
+        if split.get('mtime_ns') is not None and os.path.exists(path) \
+                and os.path.getsize(path) == split.get('size'):
+            os.utime(path, ns=(split['mtime_ns'], split['mtime_ns']))
+
+
+def data_checksums(info_data, is_split=False):
+    """SHA-256 of the files `load_data` reads ({key: checksum}). Those of
+    the manifest are used as long as the files have the size and
+    modification time it records (see `restore_mtimes` for downloaded
+    files), so that the files aren't read at all. Otherwise (e.g.
+    rewritten) they're hashed"""
+    fnames, _, _ = find_data(info_data, is_split)
+    manifest = read_manifest(info_data)
+    splits = {} if manifest is None else manifest['splits']
+    checksums = {}
+    for key, fname in fnames.items():
+        if fname is None:
+            continue
+        split = splits.get(key, {})
+        stat = os.stat(fname)
+        if split.get('sha256') and split.get('size') == stat.st_size \
+                and split.get('mtime_ns') == stat.st_mtime_ns:
+            checksums[key] = split['sha256']
+        else:
+            checksums[key] = file_sha256(fname)
+    return checksums
+
+
+def find_data(info_data, is_split=False):
+    """Local .parquet (or .npz) files that `load_data` reads ({key: fname})
+    and their year and month, as listed in the manifest of `save_data`.
+    Without a manifest (data saved before manifests existed), they're
+    found by their names"""
     keys = ['full', 'train', 'val', 'test']
-    ddf = {key: None for key in keys}
+    found = {key: None for key in keys}
+    manifest = read_manifest(info_data)
+    if manifest is not None:
+        for key, split in manifest['splits'].items():
+            found[key] = f'{info_data["path_local_in"]}/{split["fname"]}'
+        return found, manifest['year'], manifest['month']
+
+    fnames = glob.glob(f'{info_data["path_local_in"]}/*.parquet') + \
+             glob.glob(f'{info_data["path_local_in"]}/*.npz')
     if is_split:
         for fname in fnames:
             for key in keys:
                 if key in fname:
-                    ddf[key] = pd.read_parquet(fname,
-                                               engine='pyarrow')
+                    found[key] = fname
     else:
         fname = fnames[0]
-        ddf['full'] = pd.read_parquet(fname, engine='pyarrow')
+        found['full'] = fname
 
     # Extract month and year using regular expressions
-    match = re.search(r'(\d{2})-(\d{4})\.parquet', fname)
+    match = re.search(r'(\d{2})-(\d{4})\.(?:parquet|npz)', fname)
     month = match.group(1)
     year = match.group(2)
 
+    return found, year, month
+
+
+def load_data(info_data, is_split=False, columns=None, row_groups=None):
+    """Reads the data of each split ({key: DataFrame}). Only the given
+    `columns` and/or `row_groups` (indices, see the manifest) are read.
+    Row groups are selected either in every split (list) or by split
+    ({key: list}, splits left out are read whole)"""
+    fnames, year, month = find_data(info_data, is_split)
+    if not isinstance(row_groups, dict):
+        row_groups = {key: row_groups for key in fnames}
+    ddf = {key: None if fname is None else _read(fname, columns, row_groups.get(key))
+           for key, fname in fnames.items()}
     return ddf, year, month
+
+
+# ------------------------------------------------------------ #
+# Chunked (out-of-core) reading and writing                    #
+# ------------------------------------------------------------ #
+
+def iter_data(fname, columns=None, chunk_size=None):
+    """Reads a .parquet file chunk by chunk: a DataFrame per row group,
+    or per `chunk_size` rows at most. The index is the one pd.read_parquet
+    would give (a range index continues across chunks)"""
+    pf = pq.ParquetFile(fname)
+    if chunk_size:
+        chunks = (pa.Table.from_batches([batch])
+                  for batch in pf.iter_batches(batch_size=chunk_size, columns=columns,
+                                               use_pandas_metadata=True))
+    else:
+        chunks = (pf.read_row_group(i, columns=columns, use_pandas_metadata=True)
+                  for i in range(pf.num_row_groups))
+    offset = 0
+    for chunk in chunks:
+        df = sort_categories(chunk.to_pandas())
+        if isinstance(df.index, pd.RangeIndex):
+            df.index = pd.RangeIndex(offset, offset + len(df))
+        offset += len(df)
+        yield df
+
+
+class DataWriter:
+    """
+    Writes DataFrames chunk by chunk into the .parquet files of
+    `save_data` (one per key with is_split=True, e.g. train/val/test),
+    so that the whole data is never in memory. Chunks are buffered until
+    they fill a row group of `row_group_size` rows. The schema of each
+    file is taken from its first chunk (later ones are cast to it).
+    With storage='sparse' each chunk is kept as a CSR matrix (zeros of
+    `dense_columns` stored, see `to_csr`) and they are saved together
+    (.npz) on close.
+
+        with DataWriter(info_data, year, month, is_split=True) as writer:
+            for chunk in chunks:
+                writer.write(chunk, key='train')
+    """
+
+    def __init__(self, info_data, year, month,
+                 is_split=False, row_group_size=100_000,
+                 storage='dense', dense_columns=()):
+        _check_storage(storage)
+        self.info_data = info_data
+        self.year = year
+        self.month = month
+        self.is_split = is_split
+        self.row_group_size = row_group_size
+        self.storage = storage
+        self.dense_columns = dense_columns
+        self.n_rows = {}
+        self._writers = {}
+        self._buffers = {}
+        self._sparse = {}
+        self._closed = False
+
+    def _fname(self, key):
+        pre = self.info_data["prefix_name"]
+        extension = EXTENSIONS[self.storage]
+        if self.is_split:
+            return f'{pre}_{key}_{self.month}-{self.year}.{extension}'
+        return f'{pre}_{self.month}-{self.year}.{extension}'
+
+    def write(self, df, key='full'):
+        if len(df) == 0:
+            return
+        if self.storage == 'sparse':
+            if key not in self._sparse:
+                self._sparse[key] = {'columns': list(df.columns), 'matrices': [], 'index': []}
+                self.n_rows[key] = 0
+            self._sparse[key]['matrices'].append(to_csr(df, self.dense_columns))
+            self._sparse[key]['index'].append(df.index.to_numpy())
+            self.n_rows[key] += len(df)
+            return
+        if self.storage == 'float32':
+            df = df.astype(np.float32)
+        table = pa.Table.from_pandas(df, preserve_index=True)
+        if key not in self._writers:
+            path = f'{self.info_data["path_local_out"]}/{self._fname(key)}'
+            self._writers[key] = pq.ParquetWriter(path, table.schema)
+            self._buffers[key] = []
+            self.n_rows[key] = 0
+        writer = self._writers[key]
+        self._buffers[key].append(table.cast(writer.schema))
+        self.n_rows[key] += len(df)
+        if sum(len(t) for t in self._buffers[key]) >= self.row_group_size:
+            self._flush(key, full_only=True)
+
+    def _flush(self, key, full_only=False):
+        table = pa.concat_tables(self._buffers[key])
+        size = self.row_group_size
+        n_write = len(table) // size * size if full_only else len(table)
+        if n_write:
+            self._writers[key].write_table(table.slice(0, n_write), row_group_size=size)
+        self._buffers[key] = [table.slice(n_write)]
+
+    def close(self):
+        """Writes what's left and returns info_data (as `save_data`)"""
+        if not self._closed:
+            for key, writer in self._writers.items():
+                self._flush(key)
+                writer.close()
+            for key, chunks in self._sparse.items():
+                save_sparse(sp.vstack(chunks['matrices'], format='csr'),
+                            f'{self.info_data["path_local_out"]}/{self._fname(key)}',
+                            chunks['columns'], np.concatenate(chunks['index']))
+            self._closed = True
+            fnames = {key: self._fname(key) for key in self.n_rows}
+            self.info_data["fnames"] = list(fnames.values())
+            write_manifest(self.info_data, self.year, self.month, fnames)
+        return self.info_data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _read_csv_options(block_size):
+    read_options = pv.ReadOptions(block_size=block_size)
+    # Descriptions (blurb) can span several lines
+    parse_options = pv.ParseOptions(newlines_in_values=True)
+    return read_options, parse_options
+
+
+# Types tried (in order) for the values of a CSV column, as pd.read_csv
+# would read them
+CSV_TYPES = [pa.int64(), pa.float64(), pa.bool_()]
+
+
+def _infer_type(column):
+    """Type of a batch of a CSV column (read as text): the first one of
+    CSV_TYPES that holds all its values, string otherwise (null if the
+    batch has no values)"""
+    if column.null_count == len(column):
+        return pa.null()
+    for data_type in CSV_TYPES:
+        try:
+            # A failed cast still goes through the whole column, so most
+            # types are ruled out on the first values
+            pc.cast(column.slice(0, 100), data_type)
+            pc.cast(column, data_type)
+            return data_type
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            continue
+    return pa.string()
+
+
+def _unify(data_type, other):
+    """Type that holds the values of both types (as pd.concat would)"""
+    if data_type == other or pa.types.is_null(other):
+        return data_type
+    if pa.types.is_null(data_type):
+        return other
+    numeric = (pa.int64(), pa.float64())
+    if data_type in numeric and other in numeric:
+        return pa.float64()
+    return pa.string()
+
+
+def csv_zip_schema(zf, members, block_size):
+    """Schema of the CSV members of a ZIP file (column order of the first
+    member). Streamed batches take the types inferred from the first one,
+    so this is a pass over all of them (read as text, one at a time).
+    As with pd.read_csv, integer columns are int64 unless there are
+    floats or missing values in any batch (float64), and columns with
+    no values at all are float64"""
+    read_options, parse_options = _read_csv_options(block_size)
+    fields, has_nulls, member_names = {}, set(), []
+    for member in members:
+        with zf.open(member) as f:
+            names = pv.open_csv(f, read_options=read_options,
+                                parse_options=parse_options).schema.names
+        convert_options = pv.ConvertOptions(column_types={name: pa.string() for name in names},
+                                            strings_can_be_null=True)
+        with zf.open(member) as f:
+            reader = pv.open_csv(f, read_options=read_options,
+                                 parse_options=parse_options,
+                                 convert_options=convert_options)
+            for batch in reader:
+                for name, column in zip(batch.schema.names, batch.columns):
+                    fields[name] = _unify(fields.get(name, pa.null()), _infer_type(column))
+                    if column.null_count:
+                        has_nulls.add(name)
+        member_names.append(set(names))
+    # Columns missing in some members are null there
+    has_nulls.update(name for name in fields
+                     if not all(name in names for names in member_names))
+    for name, data_type in fields.items():
+        if pa.types.is_null(data_type) or (data_type == pa.int64() and name in has_nulls):
+            fields[name] = pa.float64()
+    return pa.schema(list(fields.items()))
+
+
+def _conform(batch, schema):
+    """Batch with the columns of the schema, in its order (missing ones null)"""
+    columns = []
+    for field in schema:
+        if field.name in batch.schema.names:
+            columns.append(batch.column(field.name).cast(field.type))
+        else:
+            columns.append(pa.nulls(batch.num_rows, type=field.type))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def _check_not_null(batch, schema, member):
+    nulls = {field.name: batch.column(field.name).null_count for field in schema
+             if not field.nullable and field.name in batch.schema.names}
+    nulls = {name: count for name, count in nulls.items() if count}
+    if nulls:
+        raise ValueError(f'Missing values in {member}: {nulls}')
+
+
+def save_csv_zip(zip_path, info_data,
+                 year, month,
+                 row_group_size=100_000,
+                 block_size=16 << 20,
+                 schema=None):
+    """Streams the CSV files of a ZIP file into a single .parquet file
+    (same name as `save_data`). Each CSV is read incrementally in batches
+    of `block_size` bytes, which are written straight into row groups of
+    (at most) `row_group_size` rows, so that only a batch is held in memory.
+
+    With a `schema` (Arrow) only its columns are read, with its types,
+    and non-nullable fields are checked for missing values. Otherwise
+    every column is read, with types inferred from the data"""
+    fname = f'{info_data["prefix_name"]}_{month}-{year}.parquet'
+    read_options, parse_options = _read_csv_options(block_size)
+    with zipfile.ZipFile(zip_path) as zf:
+        members = [m for m in zf.namelist() if m.endswith('.csv')]
+        if not members:
+            raise ValueError(f'No .csv files in {zip_path}')
+        if schema is None:
+            schema = csv_zip_schema(zf, members, block_size)
+            include_columns = []
+        else:
+            include_columns = schema.names
+        # Empty fields are nulls (NaN in pandas), not empty strings
+        convert_options = pv.ConvertOptions(column_types=schema,
+                                            include_columns=include_columns,
+                                            strings_can_be_null=True)
+        with pq.ParquetWriter(f'{info_data["path_local_out"]}/{fname}', schema) as writer:
+            # Batches are buffered until they fill a row group
+            buffer, n_rows = [], 0
+            for member in members:
+                with zf.open(member) as f:
+                    reader = pv.open_csv(f, read_options=read_options,
+                                         parse_options=parse_options,
+                                         convert_options=convert_options)
+                    for batch in reader:
+                        _check_not_null(batch, schema, member)
+                        buffer.append(_conform(batch, schema))
+                        n_rows += batch.num_rows
+                        if n_rows >= row_group_size:
+                            table = pa.Table.from_batches(buffer, schema=schema)
+                            full = n_rows // row_group_size * row_group_size
+                            writer.write_table(table.slice(0, full), row_group_size=row_group_size)
+                            buffer = table.slice(full).to_batches()
+                            n_rows -= full
+            if n_rows:
+                writer.write_table(pa.Table.from_batches(buffer, schema=schema))
+    info_data['fnames'] = [fname]
+    return write_manifest(info_data, year, month, {'full': fname})
+
+
+# ------------------------------------------------------------ #
+# Cumulative dataset (incremental monthly snapshots)           #
+# ------------------------------------------------------------ #
+
+def _load_index(path_index):
+    if os.path.exists(path_index):
+        return pd.read_parquet(path_index)
+    return pd.DataFrame({'id': pd.Series(dtype='int64'),
+                         'row_hash': pd.Series(dtype='uint64'),
+                         'part': pd.Series(dtype='object')})
+
+
+def append_snapshot(path_snapshot, info_data,
+                    year, month,
+                    id_column='id',
+                    batch_size=100_000):
+    """Appends the projects of a snapshot that are new (or changed since
+    they were last appended) to the cumulative dataset: a directory with
+    a .parquet file per snapshot plus an index (`_index.parquet`) with
+    the id, row hash and file of the latest version of each project.
+    The snapshot is read in batches and projects repeated in it are only
+    taken once (the first time, as DropRowsWithSameIDTransformer does).
+    Returns the file written (relative to `path_local_out`, None if there
+    was nothing new) and its number of rows"""
+    dir_name = f'{info_data["prefix_name"]}_cumulative'
+    path_dir = f'{info_data["path_local_out"]}/{dir_name}'
+    os.makedirs(path_dir, exist_ok=True)
+    path_index = f'{path_dir}/_index.parquet'
+    index = _load_index(path_index)
+    known = pd.Index(index['id'])
+    known_hashes = index['row_hash'].to_numpy()
+
+    n_parts = len(glob.glob(f'{path_dir}/part-*.parquet'))
+    part = f'part-{n_parts:05d}_{month}-{year}.parquet'
+    snapshot = pq.ParquetFile(path_snapshot)
+    schema = snapshot.schema_arrow
+    seen, updates, writer, n_rows = set(), [], None, 0
+    for batch in snapshot.iter_batches(batch_size=batch_size):
+        df = batch.to_pandas()
+        df = df[~df[id_column].duplicated()]
+        df = df[~df[id_column].isin(seen)]
+        seen.update(df[id_column].tolist())
+
+        row_hash = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        position = known.get_indexer(df[id_column])
+        is_new = position == -1
+        keep = is_new.copy()
+        # Known projects are kept only if their content changed
+        keep[~is_new] = known_hashes[position[~is_new]] != row_hash[~is_new]
+        if not keep.any():
+            continue
+        if writer is None:
+            writer = pq.ParquetWriter(f'{path_dir}/{part}', schema)
+        writer.write_table(pa.Table.from_pandas(df[keep], schema=schema,
+                                                preserve_index=False))
+        updates.append(pd.DataFrame({'id': df[id_column].to_numpy()[keep].astype('int64'),
+                                     'row_hash': row_hash[keep],
+                                     'part': part}))
+        n_rows += int(keep.sum())
+    if writer is None:
+        return None, 0
+    writer.close()
+
+    updates = pd.concat(updates, ignore_index=True)
+    index = pd.concat([index[~index['id'].isin(updates['id'])], updates],
+                      ignore_index=True)
+    index.to_parquet(f'{path_index}.tmp', index=False)
+    os.replace(f'{path_index}.tmp', path_index)
+    return f'{dir_name}/{part}', n_rows
+
+
+def load_cumulative(info_data, id_column='id'):
+    """Reads the cumulative dataset (latest version of each project)"""
+    path_dir = f'{info_data["path_local_in"]}/{info_data["prefix_name"]}_cumulative'
+    parts = sorted(glob.glob(f'{path_dir}/part-*.parquet'))
+    df = pd.concat([pd.read_parquet(part, engine='pyarrow') for part in parts],
+                   ignore_index=True)
+    # Later parts hold the latest versions of the projects that changed
+    return df[~df[id_column].duplicated(keep='last')].reset_index(drop=True)
@@ -1,20 +1,31 @@
+import re
 import ast
+import functools
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 from sklearn.base import BaseEstimator, TransformerMixin
 
+from utils.sketch import QuantileSketch
+
 
 # ---------- #
 # cleaner.py #
 # ---------- #
 
-# Custom transformer to drop columns with missing values
+# Custom transformer to drop columns with missing values. With
+# errors='ignore', columns that are not there (e.g. not read in the
+# first place, see utils/schema.py) are skipped
 class ColumnDropperTransformer(BaseEstimator, TransformerMixin):
-    def __init__(self, columns):
+    def __init__(self, columns, errors='raise'):
         self.columns = columns
+        self.errors = errors
 
     def transform(self, X, y=None):
-        return X.drop(self.columns, axis=1)
+        # Pipelines pickled before `errors` existed
+        errors = getattr(self, 'errors', 'raise')
+        return X.drop(self.columns, axis=1, errors=errors)
 
     def fit(self, X, y=None):
         return self
@@ -50,11 +61,39 @@ def extract_category_info(category_str):
     return words
 
 
+# "slug" of a category string, either JSON or a Python dict repr
+SLUG_PATTERN = re.compile(r"""["']slug["']\s*:\s*(?:"([^"\\]*)"|'([^'\\]*)')""")
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_category(category_str):
+    """Same as `extract_category_info`, but the slug is taken with a regex
+    (ast.literal_eval is only used for strings the regex can't handle,
+    e.g. with escaped characters) and results are memoized. Unlike
+    literal_eval, a single slug is also taken from JSON with true/null
+    or from an incomplete string"""
+    matches = SLUG_PATTERN.findall(category_str) if isinstance(category_str, str) else []
+    if len(matches) == 1:
+        words = (matches[0][0] or matches[0][1]).split('/')
+        if len(words) < 2:
+            words.append('no subcategory')
+    else:
+        words = extract_category_info(category_str)
+    if len(words) != 2:
+        raise ValueError(f'Unexpected category slug: {"/".join(words)}')
+    return tuple(words)
+
+
 def category_transformation(data):
-    """Define a separate function for the "category" column transformation"""
-    return data['category'].apply(lambda y: pd.Series(extract_category_info(y),
-                                                     index=['main_category',
-                                                            'sub_category']))
+    """Define a separate function for the "category" column transformation.
+    Each distinct category string (there are only a few hundred) is
+    parsed once"""
+    codes, uniques = pd.factorize(data['category'], use_na_sentinel=False)
+    parsed = np.array([parse_category(value) for value in uniques],
+                      dtype=object).reshape(-1, 2)
+    return pd.DataFrame({'main_category': parsed[codes, 0],
+                         'sub_category': parsed[codes, 1]},
+                        index=data.index)
 
 
 def calculate_usd_goal(data):
@@ -69,16 +108,105 @@ def calculate_usd_pledged(data):
     return pd.DataFrame(usd_pledged, columns=['usd_pledged'])
 
 
+# Custom transformer doing all the cleaning steps of `create_cleaning_pipeline`
+# (column drop, dedupe by ID, datetime conversion, category split and USD
+# conversion) in a single pass. Each output column is computed straight
+# from the input (only the rows kept) and the result is assembled once,
+# instead of copying the whole frame at every step. Same output (columns,
+# order, dtypes and index) as the step-by-step pipeline
+class FusedCleaningTransformer(BaseEstimator, TransformerMixin):
+    def __init__(self, columns, id_column, date_columns):
+        self.columns = columns
+        self.id_column = id_column
+        self.date_columns = date_columns
+
+    def fit(self, X, y=None):
+        self.feature_names_in_ = np.asarray(X.columns, dtype=object)
+        return self
+
+    def transform(self, X, y=None):
+        return self.clean(X)
+
+    def clean(self, X, drop_duplicates=True):
+        """Cleaned X. With drop_duplicates=False rows with the same ID are
+        all kept (e.g. when scoring records independently)"""
+        rows = None
+        if drop_duplicates:
+            duplicated = X[self.id_column].duplicated().to_numpy()
+            if duplicated.any():
+                rows = np.flatnonzero(~duplicated)
+        index = X.index if rows is None else X.index.take(rows)
+        dropped = set(self.columns)
+        used = {'category', 'goal', 'pledged', 'static_usd_rate'}
+
+        def column(name):
+            # Only the values are taken (the index is shared)
+            values = X[name].array
+            return pd.Series(values if rows is None else values.take(rows),
+                             index=index, name=name, copy=False)
+
+        static_usd_rate = column('static_usd_rate')
+        categories = category_transformation(column('category').to_frame())
+        output = {
+            'usd_goal': column('goal') * static_usd_rate,
+            'usd_pledged': column('pledged') * static_usd_rate,
+            'main_category': categories['main_category'],
+            'sub_category': categories['sub_category'],
+        }
+        for name in X.columns:
+            if name in dropped or name in used:
+                continue
+            if name in self.date_columns:
+                output[name] = pd.to_datetime(column(name), origin='unix', unit='s')
+            else:
+                output[name] = column(name)
+        # The columns (already new objects) are not copied again
+        return pd.DataFrame(output, copy=False)
+
+
 # ----------------- #
 # build_features.py #
 # ----------------- #
 
+# Words are runs of characters other than the ones str.split() splits on
+# (those for which str.isspace() is True), as an RE2 pattern
+WORD_PATTERN = (r'[^\t\n\x{0b}\x{0c}\r\x{1c}-\x{1f} \x{85}\x{a0}\x{1680}\x{2000}-\x{200a}'
+                r'\x{2028}\x{2029}\x{202f}\x{205f}\x{3000}]+')
+
+
+def count_words(text):
+    """Same as text.str.split().str.len() (NaN for missing values), but
+    the words are counted by Arrow over the string buffer, without
+    building a list of words per row"""
+    if isinstance(text.dtype, pd.StringDtype) and getattr(text.dtype, 'na_value', pd.NA) is pd.NA:
+        # Nullable strings (pd.NA): their own output dtype
+        return text.str.split().str.len()
+    try:
+        array = pa.array(text, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # e.g. not only strings
+        return text.str.split().str.len()
+    if pa.types.is_dictionary(array.type):
+        # Categorical: words of each category, taken by code
+        counts = pc.take(pc.count_substring_regex(array.dictionary, WORD_PATTERN),
+                         array.indices)
+    elif pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        counts = pc.count_substring_regex(array, WORD_PATTERN)
+    else:
+        # e.g. only missing values
+        return text.str.split().str.len()
+    values = counts.fill_null(0).to_numpy(zero_copy_only=False).astype(np.int64)
+    if counts.null_count:
+        values = np.where(counts.is_null().to_numpy(zero_copy_only=False), np.nan, values)
+    return pd.Series(values, index=text.index)
+
+
 def calculate_name_length(data):
-    return data['name'].str.split().str.len().to_frame('name_length')
+    return count_words(data['name']).to_frame('name_length')
 
 
 def calculate_description_length(data):
-    description_length = data['blurb'].str.split().str.len()
+    description_length = count_words(data['blurb'])
     # Make sure to replace null values for length 0
     return description_length.fillna(0).to_frame('description_length')
 
@@ -99,33 +227,108 @@ def calculate_campaign_hours(data):
 # the medians on the training set and use the same median values for
 # transforming the validation and test sets
 
-def calculate_diff_main_category_goal(data, medians):
-    main_categories = data['main_category'].values
-    median_main = medians['main_category'][main_categories].values
+def lookup_medians(categories, medians, default=np.nan):
+    """Median of each category (array), `default` for categories that
+    are not in `medians` (a Series indexed by category)"""
+    lookup = np.append(medians.to_numpy(dtype=np.float64), default)
+    # Unknown categories get -1, the position of the default
+    return lookup[medians.index.get_indexer(categories)]
+
+
+def calculate_diff_main_category_goal(data, medians, default=np.nan):
+    median_main = lookup_medians(data['main_category'], medians['main_category'], default)
     return abs(data['usd_goal'] - median_main).to_frame('diff_main_category_goal')
 
 
-def calculate_diff_sub_category_goal(data, medians):
-    sub_categories = data['sub_category'].values
-    median_sub = medians['sub_category'][sub_categories].values
+def calculate_diff_sub_category_goal(data, medians, default=np.nan):
+    median_sub = lookup_medians(data['sub_category'], medians['sub_category'], default)
     return abs(data['usd_goal'] - median_sub).to_frame('diff_sub_category_goal')
 
 
 class MedianDiffCalculatorTransformer(BaseEstimator, TransformerMixin):
-    def __init__(self):
+    """
+    Adds the absolute difference between the goal (usd_goal) of each
+    project and the median goal of its main and sub category.
+
+    method='exact' computes the medians with pandas. method='sketch'
+    estimates them with mergeable sketches (utils/sketch.py), within
+    `relative_accuracy` of an actual median of each category: they can
+    be fitted chunk by chunk (`partial_fit`) and fitted instances (e.g.
+    one per worker) combined with `merge`.
+
+    Categories not seen in training get the median goal of the whole
+    training set (`global_median_`).
+    """
+
+    keys = ['main_category', 'sub_category']
+
+    def __init__(self, method='exact', relative_accuracy=0.01):
+        self.method = method
+        self.relative_accuracy = relative_accuracy
         self.medians = None
 
     def fit(self, X, y=None):
-        self.medians = {
-            'main_category': X.groupby("main_category")['usd_goal'].median(),
-            'sub_category': X.groupby("sub_category")['usd_goal'].median()
-        }
+        if self.method == 'sketch':
+            self.sketches_ = None
+            return self.partial_fit(X)
+        if self.method != 'exact':
+            raise ValueError(f"Unknown method: {self.method} (use 'exact' or 'sketch')")
+        self.medians = {key: X.groupby(key)['usd_goal'].median() for key in self.keys}
+        self.global_median_ = X['usd_goal'].median()
+        return self
+
+    def _new_sketch(self):
+        return QuantileSketch(self.relative_accuracy)
+
+    def partial_fit(self, X, y=None):
+        """Adds the goals of X to the sketches (method='sketch' only)"""
+        if self.method != 'sketch':
+            raise ValueError("partial_fit needs method='sketch'")
+        if getattr(self, 'sketches_', None) is None:
+            self.sketches_ = {key: {} for key in self.keys}
+            self.sketches_['all'] = self._new_sketch()
+        goals = X['usd_goal'].to_numpy(dtype=np.float64)
+        self.sketches_['all'].add(goals)
+        for key in self.keys:
+            codes, categories = pd.factorize(X[key])
+            # Goals grouped by category code (-1: missing category, skipped)
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(categories) + 1))
+            for i, category in enumerate(categories):
+                values = goals[order[bounds[i]:bounds[i + 1]]]
+                self.sketches_[key].setdefault(category, self._new_sketch()).add(values)
+        return self._update_medians()
+
+    def merge(self, other):
+        """Adds the sketches of another fitted instance (method='sketch')"""
+        if self.method != 'sketch' or other.method != 'sketch':
+            raise ValueError("merge needs method='sketch'")
+        if getattr(self, 'sketches_', None) is None:
+            self.sketches_ = {key: {} for key in self.keys}
+            self.sketches_['all'] = self._new_sketch()
+        self.sketches_['all'].merge(other.sketches_['all'])
+        for key in self.keys:
+            for category, sketch in other.sketches_[key].items():
+                self.sketches_[key].setdefault(category, self._new_sketch()).merge(sketch)
+        return self._update_medians()
+
+    def _update_medians(self):
+        self.medians = {}
+        for key in self.keys:
+            categories = sorted(self.sketches_[key])
+            self.medians[key] = pd.Series([self.sketches_[key][c].quantile(0.5) for c in categories],
+                                          index=pd.Index(categories, name=key),
+                                          name='usd_goal')
+        self.global_median_ = self.sketches_['all'].quantile(0.5)
         return self
 
     def transform(self, X, y=None):
-        X_transformed = X.copy()
-        X_transformed['diff_main_category_goal'] = calculate_diff_main_category_goal(X_transformed, self.medians)
-        X_transformed['diff_sub_category_goal'] = calculate_diff_sub_category_goal(X_transformed, self.medians)
+        # Shallow copy: the new columns are added without copying X's data
+        X_transformed = X.copy(deep=False)
+        # Pipelines pickled before `global_median_` existed: NaN
+        default = getattr(self, 'global_median_', np.nan)
+        X_transformed['diff_main_category_goal'] = calculate_diff_main_category_goal(X, self.medians, default)
+        X_transformed['diff_sub_category_goal'] = calculate_diff_sub_category_goal(X, self.medians, default)
         return X_transformed
 
 
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pandas.api.types import union_categoricals
+
+
+# ------------------------------------------------------------ #
+# Declared schema of the raw Kickstarter data                  #
+# ------------------------------------------------------------ #
+
+# Only the columns the cleaning pipeline keeps are read (the rest, e.g.
+# `creator`, `photo`, `urls` or `profile`, are dropped by the cleaner
+# anyway), with compact dtypes
+RAW_SCHEMA = {
+    'id': 'int32',
+    'name': 'str',
+    'blurb': 'str',
+    'category': 'str',
+    'country': 'category',
+    'state': 'category',
+    'staff_pick': 'bool',
+    'backers_count': 'int32',
+    'goal': 'float32',
+    'pledged': 'float32',
+    'static_usd_rate': 'float32',
+    # Unix timestamps (seconds)
+    'created_at': 'int64',
+    'launched_at': 'int64',
+    'deadline': 'int64',
+}
+
+# Columns that can't have missing values (only `name`, `blurb` and
+# `pledged` can)
+RAW_NOT_NULL = ['id', 'category', 'country', 'state', 'staff_pick',
+                'backers_count', 'goal', 'static_usd_rate',
+                'created_at', 'launched_at', 'deadline']
+
+_ARROW_TYPES = {
+    'int32': pa.int32(),
+    'int64': pa.int64(),
+    'float32': pa.float32(),
+    'bool': pa.bool_(),
+    'str': pa.string(),
+    'category': pa.dictionary(pa.int32(), pa.string()),
+}
+
+
+def raw_arrow_schema():
+    """RAW_SCHEMA as an Arrow schema (categories are dictionary encoded)"""
+    return pa.schema([pa.field(name, _ARROW_TYPES[dtype], nullable=name not in RAW_NOT_NULL)
+                      for name, dtype in RAW_SCHEMA.items()])
+
+
+def raw_read_csv_kwargs():
+    """Arguments of pd.read_csv that project and type the raw columns"""
+    return {'usecols': list(RAW_SCHEMA),
+            # Integer (and boolean) columns are cast by `validate_raw`,
+            # once checked for nulls and out of range values
+            'dtype': {name: (str if dtype == 'str' else dtype)
+                      for name, dtype in RAW_SCHEMA.items()
+                      if dtype in ('str', 'float32', 'category')}}
+
+
+def validate_raw(df):
+    """Checks a raw DataFrame against RAW_SCHEMA and returns its columns
+    with the declared dtypes. Raises ValueError listing every problem"""
+    missing = [name for name in RAW_SCHEMA if name not in df.columns]
+    if missing:
+        raise ValueError(f'Missing raw columns: {missing}')
+    df = df[list(RAW_SCHEMA)]
+
+    errors = []
+    for name in RAW_NOT_NULL:
+        n_null = int(df[name].isna().sum())
+        if n_null:
+            errors.append(f'{name}: {n_null} missing values')
+    for name, dtype in RAW_SCHEMA.items():
+        if not dtype.startswith('int'):
+            continue
+        values = df[name].dropna()
+        limits = np.iinfo(dtype)
+        if not pd.api.types.is_numeric_dtype(values) or \
+                not ((values % 1 == 0).all() and values.between(limits.min, limits.max).all()):
+            errors.append(f'{name}: values are not {dtype}')
+    if errors:
+        raise ValueError('Invalid raw data: ' + '; '.join(errors))
+
+    return df.astype({name: dtype for name, dtype in RAW_SCHEMA.items() if dtype != 'str'})
+
+
+def concat_raw(dfs):
+    """pd.concat of raw DataFrames that keeps categorical columns as such
+    (their categories are unified and sorted first)"""
+    dfs = list(dfs)
+    for name, dtype in RAW_SCHEMA.items():
+        if dtype == 'category':
+            categories = union_categoricals([df[name] for df in dfs], sort_categories=True).categories
+            dfs = [df.assign(**{name: df[name].cat.set_categories(categories)}) for df in dfs]
+    return pd.concat(dfs, ignore_index=True)
@@ -0,0 +1,89 @@
+import numpy as np
+
+from collections import Counter
+
+
+# ------------------------------------------------------------ #
+# Mergeable quantile sketch (relative error)                   #
+# ------------------------------------------------------------ #
+
+class QuantileSketch:
+    """
+    DDSketch (Masson et al., 2019): values are counted in buckets whose
+    bounds grow geometrically, so that any quantile is estimated with a
+    bounded relative error. For a quantile q of n values,
+
+        |estimate - x| <= relative_accuracy * |x|
+
+    where x is the value of rank floor(q * (n - 1)) of the sorted values
+    (for the median of an even number of values, the lower of the two
+    middle ones, while pandas averages them). The size of the sketch
+    only depends on the range of the values (~ log(max/min) / (2 *
+    relative_accuracy) buckets), not on how many there are.
+
+    Sketches of different chunks (or workers) are merged by adding up
+    their bucket counts: the result is the same as sketching all the
+    values at once.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f'relative_accuracy must be in (0, 1), got {relative_accuracy}')
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.positive = Counter()
+        self.negative = Counter()
+        self.zero_count = 0
+
+    @property
+    def count(self):
+        return sum(self.positive.values()) + sum(self.negative.values()) + self.zero_count
+
+    def _add_to(self, store, values):
+        keys, counts = np.unique(np.ceil(np.log(values) / np.log(self.gamma)).astype(np.int64),
+                                 return_counts=True)
+        store.update(dict(zip(keys.tolist(), counts.tolist())))
+
+    def add(self, values):
+        """Adds an array of values (NaNs are ignored)"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if (positive := values[values > 0]).size:
+            self._add_to(self.positive, positive)
+        if (negative := -values[values < 0]).size:
+            self._add_to(self.negative, negative)
+        self.zero_count += int((values == 0).sum())
+        return self
+
+    def merge(self, other):
+        """Adds the values of another sketch (same relative accuracy)"""
+        if other.gamma != self.gamma:
+            raise ValueError('Only sketches with the same relative accuracy can be merged')
+        self.positive.update(other.positive)
+        self.negative.update(other.negative)
+        self.zero_count += other.zero_count
+        return self
+
+    def _value(self, key):
+        # Middle of the bucket (gamma^(key-1), gamma^key] in relative terms
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        """Estimated q-quantile (NaN if the sketch is empty)"""
+        n = self.count
+        if n == 0:
+            return np.nan
+        rank = int(q * (n - 1))
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive))
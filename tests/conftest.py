@@ -0,0 +1,58 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+CATEGORIES = [('music', 'rock'), ('music', 'pop'), ('games', None), ('food', 'drinks'),
+              ('film & video', 'comedy'), ('art', None), ('technology', 'software')]
+COUNTRIES = ['US', 'GB', 'CA', 'DE']
+WORDS = ['the', 'best', 'Coffee', 'album', 'é', 'tour', ' ', 'x\x1cy', 'a\tb']
+
+
+def category_json(main, sub):
+    slug = main if sub is None else f'{main}/{sub}'
+    return json.dumps({'id': 1, 'name': (sub or main).title(), 'slug': slug,
+                       'parent_name': main.title()})
+
+
+def make_raw(n, seed=0):
+    """Raw Kickstarter projects (the columns the cleaner keeps, plus a few
+    it drops), with duplicated ids, missing blurbs and dates exactly half
+    an hour apart (ties when rounding to hours)"""
+    rng = np.random.default_rng(seed)
+    created = rng.integers(1_300_000_000, 1_680_000_000, n)
+    launched = created + rng.integers(0, 3600 * 24 * 90, n)
+    launched[::7] = created[::7] + 1800 * rng.integers(0, 50, len(created[::7]))
+    deadline = launched + rng.integers(3600 * 24 * 5, 3600 * 24 * 60, n)
+    categories = [CATEGORIES[i] for i in rng.integers(0, len(CATEGORIES), n)]
+    blurb = [' '.join(rng.choice(WORDS, rng.integers(0, 12))) for _ in range(n)]
+    blurb[::11] = [None] * len(blurb[::11])
+    df = pd.DataFrame({
+        'id': rng.integers(0, 2**31 - 1, n),
+        'name': [' '.join(rng.choice(WORDS, rng.integers(1, 6))) for _ in range(n)],
+        'blurb': blurb,
+        'category': [category_json(main, sub) for main, sub in categories],
+        'country': rng.choice(COUNTRIES, n),
+        'state': rng.choice(['failed', 'successful'], n),
+        'staff_pick': rng.random(n) < 0.2,
+        'backers_count': rng.integers(0, 1000, n),
+        'goal': np.round(rng.lognormal(8, 1.5, n)),
+        'pledged': rng.random(n) * 1e4,
+        'static_usd_rate': rng.choice([1.0, 1.3, 0.74], n),
+        'created_at': created,
+        'launched_at': launched,
+        'deadline': deadline,
+        # Dropped by the cleaner
+        'creator': '{"id": 1}',
+        'usd_pledged': rng.random(n) * 1e4,
+        'spotlight': True,
+    })
+    df.loc[df.index[-5:], 'id'] = df['id'].to_numpy()[:5]
+    return df
+
+
+@pytest.fixture
+def raw():
+    return make_raw(300)
@@ -0,0 +1,28 @@
+import pandas as pd
+import pytest
+
+# data.cleaner logs its output to W&B
+pytest.importorskip('wandb')
+
+from data.cleaner import create_cleaning_pipeline, COLS_TO_DROP_MISSING, \
+                         COLS_TO_DROP_IRR, ID_COLUMN, DATE_COLUMNS
+
+
+def cleaning_pipeline(fused):
+    return create_cleaning_pipeline(COLS_TO_DROP_MISSING + COLS_TO_DROP_IRR,
+                                    ID_COLUMN, DATE_COLUMNS, fused=fused)
+
+
+def test_fused_cleaner_matches_pipeline(raw):
+    expected = cleaning_pipeline(fused=False).fit_transform(raw)
+    result = cleaning_pipeline(fused=True).fit_transform(raw)
+    assert sorted(result.columns) == sorted(expected.columns)
+    pd.testing.assert_frame_equal(result[expected.columns], expected)
+
+
+def test_fused_cleaner_keeps_index(raw):
+    # e.g. the rows of a split, shuffled
+    raw = raw.sample(frac=1, random_state=0)
+    expected = cleaning_pipeline(fused=False).fit(raw).transform(raw)
+    result = cleaning_pipeline(fused=True).fit(raw).transform(raw)
+    pd.testing.assert_frame_equal(result[expected.columns], expected)
@@ -0,0 +1,198 @@
+import base64
+import hashlib
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils import download
+from utils.download import DownloadError, download_resumable
+
+
+CONTENT = bytes(range(256)) * 1024  # 256 KB
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+# ------------------------------------------------------------ #
+# Local stand-in of a file server (HEAD, Range, If-Range, 304) #
+# ------------------------------------------------------------ #
+
+class FileServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FileHandler)
+        self.content = CONTENT
+        self.etag = '"v1"'
+        self.last_modified = 'Mon, 02 Oct 2023 10:00:00 GMT'
+        self.digest = None
+        # Bytes sent by the next GET before the connection is dropped
+        self.cut_after = None
+        # Content (and ETag) the file has once the next HEAD is answered
+        self.change_after_head = None
+        self.requests = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/file.bin'
+
+    def ranges(self):
+        """Range headers of the GET requests received"""
+        return [headers.get('Range') for method, headers in self.requests if method == 'GET']
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, status, length):
+        server = self.server
+        self.send_response(status)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', server.etag)
+        self.send_header('Last-Modified', server.last_modified)
+        if server.digest:
+            self.send_header('Digest', f'sha-256={server.digest}')
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+
+    def do_HEAD(self):
+        server = self.server
+        with server._lock:
+            server.requests.append(('HEAD', dict(self.headers)))
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._headers(200, len(server.content))
+        if server.change_after_head is not None:
+            server.content, server.etag = server.change_after_head
+            server.change_after_head = None
+
+    def do_GET(self):
+        server = self.server
+        with server._lock:
+            server.requests.append(('GET', dict(self.headers)))
+            cut_after, server.cut_after = server.cut_after, None
+        content = server.content
+        start, end = 0, len(content) - 1
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        partial = range_header is not None and if_range in (None, server.etag, server.last_modified)
+        if partial:
+            start, end = (int(pos) for pos in range_header[len('bytes='):].split('-'))
+        body = content[start:end + 1]
+        self._headers(206 if partial else 200, len(body))
+        if cut_after is not None:
+            self.wfile.write(body[:cut_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = FileServer()
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(download.time, 'sleep', lambda seconds: None)
+
+
+# ----- #
+# Tests #
+# ----- #
+
+def test_download(server, tmp_path):
+    path = tmp_path / 'file.bin'
+    snapshot = download_resumable(server.url, str(path), expected_sha256=SHA256)
+    assert path.read_bytes() == CONTENT
+    assert snapshot == {'url': server.url, 'etag': '"v1"',
+                        'last_modified': server.last_modified, 'sha256': SHA256}
+    assert server.ranges() == [f'bytes=0-{len(CONTENT) - 1}']
+
+
+def test_multi_range_download(server, tmp_path):
+    path = tmp_path / 'file.bin'
+    snapshot = download_resumable(server.url, str(path), n_ranges=4)
+    assert path.read_bytes() == CONTENT
+    assert snapshot['sha256'] == SHA256
+    step = len(CONTENT) // 4
+    assert sorted(server.ranges()) == sorted(f'bytes={start}-{start + step - 1}'
+                                             for start in range(0, len(CONTENT), step))
+
+
+def test_resume_after_interruption(server, tmp_path):
+    path = tmp_path / 'file.bin'
+    # The connection drops after 1000 bytes, then the range is resumed
+    server.cut_after = 1000
+    download_resumable(server.url, str(path), chunk_size=100)
+    assert path.read_bytes() == CONTENT
+    assert server.ranges() == [f'bytes=0-{len(CONTENT) - 1}',
+                               f'bytes=1000-{len(CONTENT) - 1}']
+
+
+def test_resume_in_a_later_call(server, tmp_path):
+    path = tmp_path / 'file.bin'
+    server.cut_after = 1000
+    with pytest.raises(DownloadError):
+        download_resumable(server.url, str(path), chunk_size=100, max_retries=0)
+    assert (tmp_path / 'file.bin.progress.json').exists()
+    # Progress was persisted, the next call only asks for the rest
+    snapshot = download_resumable(server.url, str(path), expected_sha256=SHA256)
+    assert path.read_bytes() == CONTENT
+    assert snapshot['sha256'] == SHA256
+    assert server.ranges()[-1] == f'bytes=1000-{len(CONTENT) - 1}'
+    assert all(headers.get('If-Range') == '"v1"'
+               for method, headers in server.requests if method == 'GET')
+
+
+def test_file_changed_during_download(server, tmp_path):
+    path = tmp_path / 'file.bin'
+    # If-Range doesn't match the new ETag: the server sends the whole file (200)
+    server.change_after_head = (CONTENT[::-1], '"v2"')
+    with pytest.raises(DownloadError, match='answered with 200'):
+        download_resumable(server.url, str(path))
+    # A fresh attempt downloads the new file
+    snapshot = download_resumable(server.url, str(path))
+    assert path.read_bytes() == CONTENT[::-1]
+    assert snapshot['etag'] == '"v2"'
+
+
+def test_not_modified(server, tmp_path):
+    path = tmp_path / 'file.bin'
+    snapshot = download_resumable(server.url, str(path))
+    assert download_resumable(server.url, str(path), snapshot=snapshot) is None
+    assert server.requests[-1][1].get('If-None-Match') == '"v1"'
+    # The snapshot of another URL is not used
+    other = dict(snapshot, url=f'{server.url}?other')
+    assert download_resumable(server.url, str(path), snapshot=other) is not None
+
+
+def test_sha256_mismatch(server, tmp_path):
+    path = tmp_path / 'file.bin'
+    with pytest.raises(DownloadError, match='Checksum mismatch'):
+        download_resumable(server.url, str(path), expected_sha256='0' * 64)
+    # Neither the file nor its progress are kept
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_digest_header_mismatch(server, tmp_path):
+    path = tmp_path / 'file.bin'
+    server.digest = base64.b64encode(hashlib.sha256(b'other').digest()).decode()
+    with pytest.raises(DownloadError, match='Checksum mismatch'):
+        download_resumable(server.url, str(path))
+    server.digest = base64.b64encode(hashlib.sha256(CONTENT).digest()).decode()
+    assert download_resumable(server.url, str(path))['sha256'] == SHA256
@@ -0,0 +1,64 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# data.cleaner and features.build_features log their output to W&B
+pytest.importorskip('wandb')
+
+from conftest import make_raw, category_json
+from data.cleaner import create_cleaning_pipeline, COLS_TO_DROP_MISSING, \
+                         COLS_TO_DROP_IRR, ID_COLUMN, DATE_COLUMNS
+from features.build_features import create_feat_eng_pipeline, CATEGORICAL_FEATURES
+from utils.inference import compile_pipelines, transform_raw_records
+
+
+# As in build_features.main
+COLS_TO_DROP = ['backers_count', 'created_at', 'deadline', 'launched_at', 'usd_pledged', 'id']
+COLS_TO_LOG = {'yes': ['usd_goal', 'creation_to_launch_hours',
+                       'diff_main_category_goal', 'diff_sub_category_goal'],
+               'no': ['sub_category', 'staff_pick', 'name_length', 'description_length',
+                      'campaign_hours', 'country', 'main_category']}
+COLS_TO_SCALE_ENCODE = {'cat': CATEGORICAL_FEATURES,
+                        'num': ['creation_to_launch_hours', 'campaign_hours', 'name_length',
+                                'description_length', 'usd_goal', 'diff_main_category_goal',
+                                'diff_sub_category_goal'],
+                        'target': ['state'],
+                        'target_mapping': [['failed', 'successful']]}
+
+
+def fitted_pipelines(raw, fused, categorical):
+    cleaner_pipe = create_cleaning_pipeline(COLS_TO_DROP_MISSING + COLS_TO_DROP_IRR,
+                                            ID_COLUMN, DATE_COLUMNS, fused=fused)
+    engineer_pipe = create_feat_eng_pipeline(COLS_TO_DROP, COLS_TO_LOG, COLS_TO_SCALE_ENCODE,
+                                             categorical=categorical)
+    engineer_pipe.fit(cleaner_pipe.fit_transform(raw))
+    return cleaner_pipe, engineer_pipe
+
+
+def records():
+    """Raw records as the web service receives them (decoded JSON)"""
+    df = make_raw(40, seed=1).drop(columns='state')
+    records = json.loads(df.to_json(orient='records'))
+    # Categories not seen in training
+    records[0]['category'] = category_json('dance', 'ballet')
+    records[1]['category'] = category_json('music', 'punk')
+    records[2]['country'] = 'JP'
+    # Missing or null text fields
+    del records[3]['blurb']
+    records[4]['name'] = None
+    # Same id (records are scored independently)
+    records[5]['id'] = records[6]['id']
+    return records
+
+
+@pytest.mark.parametrize('fused', [False, True])
+@pytest.mark.parametrize('categorical', ['onehot', 'native'])
+def test_compiled_pipeline_matches_pipelines(raw, fused, categorical):
+    cleaner_pipe, engineer_pipe = fitted_pipelines(raw, fused, categorical)
+    compiled = compile_pipelines(cleaner_pipe, engineer_pipe)
+    expected = transform_raw_records(pd.DataFrame(records()), cleaner_pipe, engineer_pipe)
+    assert compiled.feature_names == list(expected.columns)
+    np.testing.assert_array_equal(compiled.transform_records(records()), expected.to_numpy())
+    np.testing.assert_array_equal(compiled.transform_record(records()[0]), expected.to_numpy()[0])
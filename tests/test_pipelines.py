@@ -0,0 +1,125 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.pipelines import extract_category_info, parse_category, category_transformation, \
+                            count_words
+
+
+def reference_category_transformation(data):
+    """`category_transformation` before the regex fast path (one
+    ast.literal_eval per row)"""
+    return data['category'].apply(lambda y: pd.Series(extract_category_info(y),
+                                                     index=['main_category',
+                                                            'sub_category']))
+
+
+def reference(category_str):
+    """Words of `extract_category_info`, or the type of the error it raises"""
+    try:
+        return tuple(extract_category_info(category_str))
+    except Exception as e:
+        return type(e)
+
+
+def parsed(category_str):
+    try:
+        return parse_category(category_str)
+    except Exception as e:
+        return type(e)
+
+
+def kickstarter_json(slug, **fields):
+    category = {'id': 43, 'name': 'Rock', 'slug': slug, 'position': 17,
+                'parent_id': 14, 'parent_name': 'Music', 'color': 10878931,
+                'urls': {'web': {'discover': f'http://www.kickstarter.com/discover/categories/{slug}'}}}
+    return json.dumps({**category, **fields})
+
+
+CATEGORY_STRINGS = [
+    # JSON, as in the raw CSV files
+    kickstarter_json('music/rock'),
+    kickstarter_json('music/hip-hop'),
+    kickstarter_json('film & video/science fiction'),
+    kickstarter_json('games/tabletop games', name='Tabletop "Games"'),
+    # No "/": no subcategory
+    kickstarter_json('games'),
+    kickstarter_json(''),
+    '{"slug": "games"}',
+    # Python dict repr, single quotes and Python values
+    "{'slug': 'music/rock', 'parent_id': None, 'staff': True}",
+    "{'name': \"Rock 'n' roll\", 'slug': 'music/rock and roll'}",
+    '{"slug" :   "art/painting"}',
+    # Quotes and escapes inside the slug (regex can't take them)
+    '{"slug": "music/rock \\"n\\" roll"}',
+    "{'slug': 'comics/graphic \\'novels\\''}",
+    '{"slug": "music/\\u00e9lectro"}',
+    # "slug" more than once (also inside other values)
+    '{"name": "\'slug\': \'x/y\'", "slug": "art/sculpture"}',
+    '{"urls": {"slug": "x/y"}, "slug": "art/sculpture"}',
+    # Too many levels, no slug, not a dict, not even a string
+    kickstarter_json('music/rock/indie'),
+    '{"name": "Rock"}',
+    '["slug", "music/rock"]',
+    '{"slug": 1}',
+    '',
+    None,
+    np.nan,
+]
+
+
+@pytest.mark.parametrize('category_str', CATEGORY_STRINGS)
+def test_parse_category_matches_literal_eval(category_str):
+    expected = reference(category_str)
+    if isinstance(expected, tuple) and len(expected) != 2:
+        # Rejected later on by the reference (can't fill two columns)
+        expected = ValueError
+    result = parsed(category_str)
+    if isinstance(expected, type):
+        assert isinstance(result, type), f'{category_str!r} should fail as with literal_eval'
+    else:
+        assert result == expected
+
+
+@pytest.mark.parametrize('category_str', [
+    '{"slug": "music/rock", "parent_id": null, "staff": true}',
+    '"slug": "music/rock"',
+    '{"slug": "music/rock"',
+])
+def test_parse_category_accepts_more_than_literal_eval(category_str):
+    # literal_eval can't read JSON literals (or fragments), the fast path
+    # only needs a single, unambiguous slug
+    assert isinstance(reference(category_str), type)
+    assert parse_category(category_str) == ('music', 'rock')
+
+
+def test_category_transformation_matches_literal_eval():
+    valid = [category_str for category_str in CATEGORY_STRINGS
+             if isinstance(reference(category_str), tuple) and len(reference(category_str)) == 2]
+    data = pd.DataFrame({'category': valid * 3, 'goal': 1.},
+                        index=np.arange(len(valid) * 3)[::-1])
+    pd.testing.assert_frame_equal(category_transformation(data),
+                                  reference_category_transformation(data),
+                                  check_dtype=False)
+
+
+TEXTS = ['', ' ', 'one', '  two  words ', 'tab\tand\nnewline', 'é accents à',
+         # Unicode whitespace (str.isspace), and characters that aren't
+         'no\xa0break', 'ideographic\u3000space', 'a\x1cb\x1dc\x1ed\x1fe',
+         'line\u2028para\u2029', 'zero\u200bwidth', 'nbsp\u202fnarrow',
+         None, np.nan]
+
+
+@pytest.mark.parametrize('dtype', [object, 'str', 'string', 'category'])
+def test_count_words_matches_split(dtype):
+    text = pd.Series(TEXTS * 2, index=np.arange(len(TEXTS) * 2)[::-1]).astype(dtype)
+    expected = text.astype(object).str.split().str.len()
+    pd.testing.assert_series_equal(count_words(text), expected, check_dtype=False)
+
+
+def test_count_words_without_strings():
+    text = pd.Series([None, np.nan], dtype=object)
+    pd.testing.assert_series_equal(count_words(text), text.str.split().str.len(),
+                                   check_dtype=False)
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from utils.sketch import QuantileSketch
+
+
+QUANTILES = [0., 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1.]
+
+
+def sample(distribution, n=10_000, seed=0):
+    rng = np.random.default_rng(seed)
+    if distribution == 'lognormal':
+        # e.g. goals in USD, over several orders of magnitude
+        return rng.lognormal(8, 2, n)
+    if distribution == 'normal':
+        # Negative values too
+        return rng.normal(0, 100, n)
+    if distribution == 'with_zeros':
+        return np.where(rng.random(n) < 0.3, 0., rng.exponential(1e3, n))
+    raise ValueError(distribution)
+
+
+def exact_quantile(values, q):
+    """Value the sketch estimates: rank floor(q * (n - 1)) of the sorted values"""
+    return np.sort(values)[int(q * (len(values) - 1))]
+
+
+@pytest.mark.parametrize('relative_accuracy', [0.01, 0.05])
+@pytest.mark.parametrize('distribution', ['lognormal', 'normal', 'with_zeros'])
+def test_relative_error_bound(distribution, relative_accuracy):
+    values = sample(distribution)
+    sketch = QuantileSketch(relative_accuracy).add(values)
+    for q in QUANTILES:
+        x = exact_quantile(values, q)
+        assert abs(sketch.quantile(q) - x) <= relative_accuracy * abs(x) * (1 + 1e-12), q
+
+
+def test_merged_sketches_match_single_sketch():
+    values = sample('normal')
+    single = QuantileSketch().add(values)
+    merged = QuantileSketch()
+    for chunk in np.array_split(values, 7):
+        merged.merge(QuantileSketch().add(chunk))
+    assert merged.count == single.count == len(values)
+    assert [merged.quantile(q) for q in QUANTILES] == [single.quantile(q) for q in QUANTILES]
+
+
+def test_nan_and_empty():
+    assert np.isnan(QuantileSketch().quantile(0.5))
+    sketch = QuantileSketch().add([np.nan, 1., np.nan])
+    assert sketch.count == 1
+    assert sketch.quantile(0.5) == pytest.approx(1., rel=0.01)
+    with pytest.raises(ValueError):
+        QuantileSketch(0.01).merge(QuantileSketch(0.05))